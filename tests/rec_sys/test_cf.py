@@ -1,8 +1,12 @@
 import pytest
-from numpy import array, append
+from numpy import array, append, where, nan, diff, shares_memory, float32
+from numpy.random import RandomState
 from numpy.testing import assert_allclose, assert_array_equal
 
-from touvlo.rec_sys.cf import cost_function, grad, unravel_params
+from touvlo.rec_sys.cf import (cost_function, grad, unravel_params,
+                               to_triplets, sparse_cost_function,
+                               sparse_grad, run_als, cost_and_grad,
+                               ParamBuffer)
 
 
 class TestCollaborativeeFiltering:
@@ -113,3 +117,190 @@ class TestCollaborativeeFiltering:
                                [-0.64787, -0.71821, 1.27007],
                                [1.09290, -0.40784, 0.49027]]),
                         rtol=0, atol=0.001, equal_nan=False)
+
+    def test_to_triplets(self, Y, R):
+        products, users, ratings = to_triplets(Y, R)
+
+        assert_array_equal(products, array([0, 0, 1, 2, 3, 4]))
+        assert_array_equal(users, array([0, 1, 0, 0, 0, 0]))
+        assert_array_equal(ratings, array([5, 4, 3, 4, 3, 3]))
+
+    @pytest.mark.parametrize('_lambda', [0, 1.5])
+    def test_sparse_cost_function(self, X, Y, R, theta, _lambda):
+        products, users, ratings = to_triplets(Y, R)
+
+        assert_allclose(sparse_cost_function(X, products, users, ratings,
+                                             theta, _lambda),
+                        cost_function(X, Y, R, theta, _lambda))
+
+    @pytest.mark.parametrize('_lambda', [0, 1.5])
+    def test_sparse_grad(self, X, Y, R, theta, _lambda):
+        num_users = 4
+        num_products = 5
+        num_features = 3
+        flat = append(X.flatten(), theta.flatten())
+        products, users, ratings = to_triplets(Y, R)
+
+        assert_allclose(sparse_grad(flat, products, users, ratings,
+                                    num_users, num_products, num_features,
+                                    _lambda),
+                        grad(flat, Y, R, num_users, num_products,
+                             num_features, _lambda))
+
+    def test_sparse_grad_random(self):
+        rand = RandomState(0)
+        num_users, num_products, num_features = 80, 20, 4
+        R = (rand.uniform(size=(num_products, num_users)) < 0.2).astype(int)
+        Y = rand.randint(1, 6, size=R.shape) * R
+        flat = rand.normal(size=(num_users + num_products) * num_features)
+        X, theta = unravel_params(flat, num_users, num_products,
+                                  num_features)
+        products, users, ratings = to_triplets(Y, R)
+
+        assert_allclose(sparse_cost_function(X, products, users, ratings,
+                                             theta, 0.7),
+                        cost_function(X, Y, R, theta, 0.7))
+        assert_allclose(sparse_grad(flat, products, users, ratings,
+                                    num_users, num_products, num_features,
+                                    0.7),
+                        grad(flat, Y, R, num_users, num_products,
+                             num_features, 0.7))
+
+        # chunks smaller than the number of ratings, many groups per chunk
+        assert_allclose(sparse_cost_function(X, products, users, ratings,
+                                             theta, 0.7, chunk_size=17),
+                        cost_function(X, Y, R, theta, 0.7))
+        assert_allclose(sparse_grad(flat, products, users, ratings,
+                                    num_users, num_products, num_features,
+                                    0.7, chunk_size=17),
+                        grad(flat, Y, R, num_users, num_products,
+                             num_features, 0.7))
+
+    def test_grad_ignores_unrated(self, X, Y, R, theta):
+        num_users = 4
+        num_products = 5
+        num_features = 3
+        flat = append(X.flatten(), theta.flatten())
+        Y_unrated = where(R == 1, Y, nan)
+
+        assert_allclose(grad(flat, Y_unrated, R, num_users, num_products,
+                             num_features, 1.5),
+                        grad(flat, Y, R, num_users, num_products,
+                             num_features, 1.5))
+
+    def test_run_als(self):
+        rand = RandomState(0)
+        num_users, num_products, num_features = 40, 30, 3
+        R = (rand.uniform(size=(num_products, num_users)) < 0.5).astype(int)
+        Y = rand.normal(size=(num_products, num_features)).dot(
+            rand.normal(size=(num_features, num_users))) * R
+        _lambda = 0.1
+
+        params, J_history = run_als(Y, R, num_features, _lambda, 2000,
+                                    tol=1e-12, block_size=7,
+                                    return_history=True, _seed=1)
+        X, theta = unravel_params(params, num_users, num_products,
+                                  num_features)
+
+        assert len(J_history) < 2000
+        assert (diff(J_history) <= 1e-10).all()
+        assert_allclose(J_history[-1],
+                        cost_function(X, Y, R, theta, _lambda))
+        assert_allclose(grad(params, Y, R, num_users, num_products,
+                             num_features, _lambda), 0, atol=1e-5)
+
+        assert_array_equal(run_als(Y, R, num_features, _lambda, 5,
+                                   block_size=7, n_jobs=2, _seed=1),
+                           run_als(Y, R, num_features, _lambda, 5,
+                                   block_size=7, _seed=1))
+
+    def test_run_als_initial_params(self, X, Y, R, theta):
+        flat = append(X.flatten(), theta.flatten())
+        params = run_als(Y, R, 3, 1.5, 1, initial_params=flat)
+
+        assert_array_equal(flat, append(X.flatten(), theta.flatten()))
+        X_als, theta_als = unravel_params(params, 4, 5, 3)
+        assert (cost_function(X_als, Y, R, theta_als, 1.5)
+                < cost_function(X, Y, R, theta, 1.5))
+
+    @pytest.mark.parametrize('_lambda', [0, 1.5])
+    def test_cost_and_grad(self, X, Y, R, theta, _lambda):
+        num_users = 4
+        num_products = 5
+        num_features = 3
+        flat = append(X.flatten(), theta.flatten())
+
+        J, params = cost_and_grad(flat, Y, R, num_users, num_products,
+                                  num_features, _lambda)
+        assert_allclose(J, cost_function(X, Y, R, theta, _lambda))
+        assert_allclose(params, grad(flat, Y, R, num_users, num_products,
+                                     num_features, _lambda))
+
+    def test_unravel_params_views(self, X, theta):
+        flat = append(X.flatten(), theta.flatten())
+        X_infltd, theta_infltd = unravel_params(flat, 4, 5, 3)
+
+        assert shares_memory(X_infltd, flat)
+        assert shares_memory(theta_infltd, flat)
+
+    def test_grad_float32(self, X, Y, R, theta):
+        flat = append(X.flatten(), theta.flatten())
+
+        assert_allclose(grad(flat.astype(float32), Y.astype(float32), R,
+                             4, 5, 3, 1.5),
+                        grad(flat, Y, R, 4, 5, 3, 1.5), rtol=1e-5)
+
+    @pytest.mark.parametrize('_lambda', [0, 1.5])
+    def test_param_buffer(self, X, Y, R, theta, _lambda):
+        num_users = 4
+        num_products = 5
+        num_features = 3
+        flat = append(X.flatten(), theta.flatten())
+        buf = ParamBuffer(num_users, num_products, num_features, flat)
+
+        assert_array_equal(buf.X, X)
+        assert_array_equal(buf.theta, theta)
+        assert shares_memory(buf.X, buf.params)
+        assert shares_memory(buf.theta_grad, buf.grad)
+
+        grad_array = buf.grad
+        J = buf.cost_and_grad(Y, R, _lambda)
+        assert buf.grad is grad_array
+        expected_J, expected_grad = cost_and_grad(flat, Y, R, num_users,
+                                                  num_products, num_features,
+                                                  _lambda)
+        assert_allclose(J, expected_J)
+        assert_allclose(buf.grad, expected_grad)
+
+        buf.step(0.01)
+        assert_allclose(buf.params, flat - 0.01 * expected_grad)
+
+    def test_param_buffer_fit(self, X, Y, R, theta):
+        flat = append(X.flatten(), theta.flatten())
+        buf = ParamBuffer(4, 5, 3, flat)
+        J_history = buf.fit(Y, R, 1.5, 0.05, 50)
+
+        params = flat
+        for _ in range(50):
+            params = params - 0.05 * grad(params, Y, R, 4, 5, 3, 1.5)
+
+        assert len(J_history) == 50
+        assert (diff(J_history) < 0).all()
+        assert_allclose(buf.params, params)
+
+    def test_param_buffer_default_params(self, Y, R):
+        buf = ParamBuffer(4, 5, 3, _seed=0)
+        assert_array_equal(buf.params, ParamBuffer(4, 5, 3, _seed=0).params)
+
+        J_history = buf.fit(Y, R, 0.1, 0.05, 20)
+        assert J_history[-1] < J_history[0]
+
+    def test_param_buffer_edited_ratings(self, X, Y, R, theta):
+        flat = append(X.flatten(), theta.flatten())
+        buf = ParamBuffer(4, 5, 3, flat)
+        R = R.copy()
+        buf.cost_and_grad(Y, R, 1.5)
+
+        R[0, 1] = 0
+        assert_allclose(buf.cost_and_grad(Y, R, 1.5),
+                        cost_function(X, Y, R, theta, 1.5))
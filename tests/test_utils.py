@@ -1,12 +1,14 @@
 from math import radians
 
 import pytest
-from numpy import array, cos, sin, exp
-from numpy.testing import assert_allclose
+from numpy import array, cos, sin, exp, float32, zeros
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_array_equal
 
 from touvlo.utils import (numerical_grad, g_grad, BGD, SGD,
                           MBGD, mean_normlztn, feature_normalize,
-                          sigmoid, relu, sigmoid_backward, relu_backward)
+                          sigmoid, relu, sigmoid_backward, relu_backward,
+                          group_sums, iter_batches)
 
 
 class TestLogisticRegression:
@@ -476,3 +478,29 @@ class TestLogisticRegression:
         assert_allclose(dZ,
                         array([[-0.10414453, -0.01044791]]),
                         rtol=0, atol=0.001, equal_nan=False)
+
+    @pytest.mark.parametrize('num_groups', [3, 100])
+    def test_group_sums(self, num_groups):
+        rand = RandomState(0)
+        idx = rand.randint(num_groups, size=500)
+        values = rand.normal(size=(500, 4)).astype(float32)
+        expected = zeros((num_groups, 4))
+        for i, row in zip(idx, values):
+            expected[i] += row
+
+        assert_allclose(group_sums(idx, values, num_groups, chunk_size=64),
+                        expected, rtol=1e-5)
+
+        out = expected.copy()
+        group_sums(idx, values, num_groups, out=out)
+        assert_allclose(out, 2 * expected, rtol=1e-5)
+
+    def test_iter_batches(self):
+        X = array([[1, 2], [3, 4], [5, 6], [7, 8], [9, 10]])
+
+        batches = list(iter_batches(X, 2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert_array_equal(batches[2], X[4:])
+
+        batches = list(iter_batches(iter([X[:3], X[3:]]), 2))
+        assert [len(batch) for batch in batches] == [3, 2]
@@ -1,11 +1,17 @@
+from math import pi
+
 import pytest
-from numpy import array
+from numpy import (array, log, zeros, ones, full, isfinite, uint8, linspace,
+                   argmax, float32, mean, save, load, tril, identity)
+from numpy.linalg import det, cholesky, LinAlgError
 from numpy.testing import (assert_allclose, assert_almost_equal,
                            assert_array_equal)
 
 from touvlo.unsupv.anmly_detc import (estimate_uni_gaussian, uni_gaussian,
                                       estimate_multi_gaussian, cov_matrix,
-                                      multi_gaussian, is_anomaly, predict)
+                                      multi_gaussian, is_anomaly, predict,
+                                      MultiGaussian, GaussianEstimator,
+                                      select_epsilon)
 
 
 class TestAnomalyDetection:
@@ -157,3 +163,182 @@ class TestAnomalyDetection:
                                [0.20953774], [0.06169397], [0.19641747],
                                [0.06984078]]),
                         rtol=0, atol=0.001, equal_nan=False)
+
+    def test_uni_gaussian_log_pdf1(self, X):
+        mu = array([14.022, 14.905])
+        sigma2 = array([0.83944, 1.06363])
+
+        assert_allclose(uni_gaussian(X, mu, sigma2, log_pdf=True),
+                        log(uni_gaussian(X, mu, sigma2)),
+                        rtol=0, atol=1e-10, equal_nan=False)
+
+    def test_uni_gaussian_log_pdf2(self):
+        mu = zeros(800)
+        sigma2 = ones(800)
+        X = ones((2, 800))
+
+        assert_array_equal(uni_gaussian(X, mu, sigma2), zeros((2, 1)))
+        assert_allclose(uni_gaussian(X, mu, sigma2, log_pdf=True),
+                        full((2, 1), -400 * (1 + log(2 * pi))),
+                        rtol=1e-12, atol=0, equal_nan=False)
+
+    def test_multi_gaussian_log_pdf(self, X):
+        mu = array([14.022, 14.905])
+        sigma = array([[0.83945644, 0.56925192], [0.56925192, 1.06358832]])
+
+        assert_allclose(multi_gaussian(X, mu, sigma, log_pdf=True),
+                        log(multi_gaussian(X, mu, sigma)),
+                        rtol=0, atol=1e-10, equal_nan=False)
+
+    def test_multi_gaussian_obj(self, X):
+        mu, sigma = estimate_multi_gaussian(X)
+        gaussian = MultiGaussian.fit(X)
+
+        assert_allclose(gaussian.mu, mu, rtol=0, atol=1e-12)
+        assert_allclose(gaussian.pdf(X), multi_gaussian(X, mu, sigma),
+                        rtol=1e-10, atol=0, equal_nan=False)
+        assert_allclose(gaussian.log_det, log(det(sigma)),
+                        rtol=1e-10, atol=0, equal_nan=False)
+
+    def test_multi_gaussian_obj_predict(self, X):
+        sigma = array([[0.83945644, 0.56925192],
+                       [0.56925192, 1.06358832]])
+        mu = array([14.022, 14.905])
+        epsilon = 0.1
+
+        assert_array_equal(predict(X, epsilon, MultiGaussian(mu, sigma)),
+                           predict(X, epsilon, multi_gaussian,
+                                   mu=mu, sigma=sigma))
+        assert_array_equal(predict(X, log(epsilon), MultiGaussian(mu, sigma),
+                                   log_pdf=True),
+                           predict(X, epsilon, multi_gaussian,
+                                   mu=mu, sigma=sigma))
+
+    def test_multi_gaussian_obj_singular(self):
+        X = array([[1, 2], [2, 4], [3, 6]])
+        mu = array([2, 4])
+        sigma = array([[1, 2], [2, 4]])
+
+        with pytest.raises(LinAlgError):
+            MultiGaussian(mu, sigma)
+
+        gaussian = MultiGaussian(mu, sigma, reg=1e-6)
+        assert all(isfinite(gaussian.log_pdf(X)))
+
+    def test_is_anomaly_output(self):
+        prob = array([[0.47], [0.28], [0.32], [0.79], [0.13]])
+        threshold = 0.4
+
+        assert_array_equal(is_anomaly(prob, threshold, output='mask'),
+                           array([False, True, True, False, True]))
+        assert_array_equal(is_anomaly(prob, threshold, output='uint8'),
+                           array([0, 1, 1, 0, 1], dtype=uint8))
+        assert_array_equal(is_anomaly(prob, threshold, output='indices'),
+                           array([1, 2, 4]))
+
+        with pytest.raises(ValueError):
+            is_anomaly(prob, threshold, output='list')
+
+    def test_predict_indices(self, X):
+        sigma2 = array([0.83944, 1.06363])
+        mu = array([14.022, 14.905]),
+        epsilon = 0.1
+
+        assert_array_equal(predict(X, epsilon, uni_gaussian, output='indices',
+                                   mu=mu, sigma2=sigma2),
+                           array([0, 1, 3, 5, 6, 7, 8, 9, 10, 14, 18, 19, 22,
+                                  24]))
+
+    def test_gaussian_estimator_batches(self, X):
+        mu, sigma = estimate_multi_gaussian(X)
+        _, sigma2 = estimate_uni_gaussian(X)
+
+        estimator = GaussianEstimator()
+        for start in range(0, len(X), 7):
+            estimator.partial_fit(X[start:(start + 7)])
+
+        assert estimator.count == len(X)
+        assert_allclose(estimator.mu, mu)
+        assert_allclose(estimator.sigma, sigma)
+        assert_allclose(estimator.sigma2, sigma2)
+
+        uni = GaussianEstimator(covariance=False)
+        for start in range(0, len(X), 4):
+            uni.partial_fit(X[start:(start + 4)])
+
+        assert_allclose(uni.mu, mu)
+        assert_allclose(uni.sigma2, sigma2)
+
+    def test_gaussian_estimator_merge(self, X):
+        mu, sigma = estimate_multi_gaussian(X)
+
+        first = GaussianEstimator().partial_fit(X[:10])
+        second = GaussianEstimator().partial_fit(X[10:])
+        first.merge(second).merge(GaussianEstimator())
+
+        assert first.count == len(X)
+        assert_allclose(first.mu, mu)
+        assert_allclose(first.sigma, sigma)
+
+    def test_select_epsilon(self, X):
+        mu, sigma2 = estimate_uni_gaussian(X)
+        p = uni_gaussian(X, mu, sigma2)
+        y = zeros((len(X), 1))
+        y[p.ravel().argsort()[:4]] = 1
+
+        epsilons = linspace(p.min(), p.max(), 50)
+        expected = []
+        for epsilon in epsilons:
+            pred = predict(X, epsilon, uni_gaussian, mu=mu, sigma2=sigma2)
+            tp = (pred * y).sum()
+            expected.append(2 * tp / (pred.sum() + y.sum()))
+
+        epsilon, F1 = select_epsilon(X, y, uni_gaussian, epsilons=epsilons,
+                                     mu=mu, sigma2=sigma2)
+        assert_almost_equal(F1, max(expected))
+        assert epsilon == epsilons[argmax(expected)]
+
+        epsilon, F1 = select_epsilon(X, y, uni_gaussian, mu=mu, sigma2=sigma2)
+        assert F1 == 1
+        assert_array_equal(predict(X, epsilon, uni_gaussian, mu=mu,
+                                   sigma2=sigma2), y)
+
+        y[p.ravel().argsort()[4]] = 1
+        _, F1 = select_epsilon(X, y, uni_gaussian, epsilons=epsilons,
+                               mu=mu, sigma2=sigma2)
+        assert F1 < 1
+
+    def test_cov_matrix_chunks(self, X, tmp_path):
+        mu = mean(X, axis=0)
+        sigma = cov_matrix(X, mu)
+
+        assert_allclose(cov_matrix(X, mu, chunk_size=4), sigma)
+        assert_allclose(cov_matrix(iter([X[:10], X[10:]]), mu), sigma)
+
+        path = tmp_path / 'X.npy'
+        save(path, X)
+        assert_allclose(cov_matrix(load(path, mmap_mode='r'), mu,
+                                   chunk_size=6), sigma)
+
+        sigma32 = cov_matrix(X, mu, chunk_size=6, dtype=float32)
+        assert sigma32.dtype == float32
+        assert_allclose(sigma32, sigma, rtol=1e-4)
+
+    def test_multi_gaussian_obj_factor(self, X):
+        mu, sigma = estimate_multi_gaussian(X)
+        gaussian = MultiGaussian(mu, sigma)
+        L = cholesky(sigma)
+
+        assert_array_equal(gaussian.L_inv, tril(gaussian.L_inv))
+        assert_allclose(gaussian.L_inv.dot(L), identity(2), atol=1e-12)
+
+    def test_multi_gaussian_reg(self):
+        X = array([[1, 2], [2, 4], [3, 6]])
+        mu = array([2, 4])
+        sigma = array([[1, 2], [2, 4]])
+
+        with pytest.raises(LinAlgError):
+            multi_gaussian(X, mu, sigma)
+
+        assert_allclose(multi_gaussian(X, mu, sigma, reg=1e-6),
+                        MultiGaussian(mu, sigma, reg=1e-6).pdf(X))
@@ -0,0 +1,73 @@
+import pytest
+from numpy import array
+from numpy.testing import assert_allclose, assert_array_equal
+
+from touvlo.unsupv.dist import (sq_euclidean, euclidean, cosine, manhattan,
+                                pairwise_dist, closest, paired_dist)
+
+
+class TestDist:
+
+    @pytest.fixture
+    def A(self):
+        return array([[1, 7, 4, 2, -1], [8, 6, 3, 4, 10], [0, 0, 0, 0, 0]])
+
+    @pytest.fixture
+    def B(self):
+        return array([[8, 6, 3, 4, 10], [1, 0, 0, 0, 1]])
+
+    def test_sq_euclidean(self, A, B):
+        assert_allclose(sq_euclidean(A, B),
+                        array([[176, 73], [0, 191], [225, 2]]),
+                        rtol=0, atol=1e-8, equal_nan=False)
+
+    def test_euclidean(self, A, B):
+        assert_allclose(euclidean(A, B),
+                        array([[13.266499, 8.544004], [0, 13.820275],
+                               [15, 1.414214]]),
+                        rtol=0, atol=1e-6, equal_nan=False)
+
+    def test_cosine(self, A, B):
+        assert_allclose(cosine(A, B),
+                        array([[0.525287, 1], [0, 0.151472], [1, 1]]),
+                        rtol=0, atol=1e-6, equal_nan=False)
+
+    def test_manhattan(self, A, B):
+        assert_allclose(manhattan(A, B),
+                        array([[22, 15], [0, 29], [31, 2]]),
+                        rtol=0, atol=1e-8, equal_nan=False)
+
+    def test_pairwise_dist_tiles(self, A, B):
+        for metric in ['euclidean', 'sqeuclidean', 'cosine', 'manhattan']:
+            assert_allclose(pairwise_dist(A, B, metric=metric, tile_size=2,
+                                          n_jobs=2),
+                            pairwise_dist(A, B, metric=metric),
+                            rtol=0, atol=1e-8, equal_nan=False)
+
+    def test_pairwise_dist_unknown_metric(self, A, B):
+        with pytest.raises(ValueError):
+            pairwise_dist(A, B, metric='chebyshev')
+
+    def test_closest(self, A, B):
+        idx, dists = closest(A, B, tile_size=2, return_dists=True)
+
+        assert_array_equal(idx, array([[1], [0], [1]]))
+        assert_allclose(dists, array([[8.544004], [0], [1.414214]]),
+                        rtol=0, atol=1e-6, equal_nan=False)
+
+    def test_closest_manhattan(self, A, B):
+        idx = closest(A, B, metric='manhattan', n_jobs=2, tile_size=1)
+        assert_array_equal(idx, array([[1], [0], [1]]))
+
+    def test_paired_dist(self, A):
+        B = array([[8, 6, 3, 4, 10], [1, 0, 0, 0, 1], [1, 0, 0, 0, 1]])
+
+        assert_allclose(paired_dist(A, B),
+                        array([13.266499, 13.820275, 1.414214]),
+                        rtol=0, atol=1e-6, equal_nan=False)
+        assert_allclose(paired_dist(A, B, metric='manhattan'),
+                        array([22, 29, 2]),
+                        rtol=0, atol=1e-8, equal_nan=False)
+        assert_allclose(paired_dist(A, B, metric='cosine'),
+                        array([0.525287, 0.151472, 1]),
+                        rtol=0, atol=1e-6, equal_nan=False)
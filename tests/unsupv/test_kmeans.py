@@ -1,11 +1,14 @@
 import pytest
-from numpy import array
-from numpy.testing import assert_allclose, assert_almost_equal
+from numpy import array, int64, int32, float32
+from numpy.random import RandomState
+from numpy.testing import (assert_allclose, assert_almost_equal,
+                           assert_array_equal)
 
 from touvlo.unsupv.kmeans import (find_closest_centroids, euclidean_dist,
                                   compute_centroids, init_centroids,
                                   cost_function, run_kmeans,
-                                  run_intensive_kmeans, elbow_method)
+                                  run_intensive_kmeans, elbow_method,
+                                  partial_fit_kmeans, run_minibatch_kmeans)
 
 
 class TestKmeans:
@@ -208,3 +211,364 @@ class TestKmeans:
         cost_values = elbow_method(X, K_values, max_iters, n_inits)
 
         assert all(cost >= 0 for cost in cost_values)
+
+    def test_find_closest_centroids3(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+        initial_centroids = array(
+            [[2.9040, 4.6122], [1.2479, 4.9327], [2.9797, 4.8067]])
+
+        idx = find_closest_centroids(X, initial_centroids, chunk_size=3)
+
+        assert idx.shape == (10, 1)
+        assert idx.dtype == int64
+        assert_array_equal(array([[1], [2], [0], [0], [2], [1],
+                                  [1], [2], [2], [2]]), idx)
+
+    def test_find_closest_centroids4(self):
+        X = array([[1, 1], [4, 5], [9, 9], [0, 1]])
+        initial_centroids = array([[0, 0], [float('nan'), float('nan')],
+                                   [8, 8]])
+
+        assert_array_equal(array([[0], [2], [2], [0]]),
+                           find_closest_centroids(X, initial_centroids))
+
+    def test_run_kmeans_hamerly1(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+        initial_centroids = array(
+            [[2.9040, 4.6122], [1.2479, 4.9327], [2.9797, 4.8067]])
+        max_iters = 10
+        K = 3
+
+        centroids, idx = run_kmeans(X, K, max_iters,
+                                    initial_centroids=initial_centroids)
+        h_centroids, h_idx = run_kmeans(X, K, max_iters,
+                                        algorithm='hamerly',
+                                        initial_centroids=initial_centroids)
+
+        assert_array_equal(idx, h_idx)
+        assert_allclose(centroids, h_centroids,
+                        rtol=0, atol=1e-10, equal_nan=True)
+
+    def test_run_kmeans_hamerly2(self):
+        X = array([[5.89562, 2.89844], [5.61754, 2.59751], [5.63176, 3.04759],
+                   [5.50259, 3.11869], [6.48213, 2.55085], [7.30279, 3.38016],
+                   [6.99198, 2.98707], [4.82553, 2.77962], [6.11768, 2.85476],
+                   [0.94049, 5.71557]])
+        initial_centroids = array([[5.89562, 2.89844], [5.61754, 2.59751],
+                                   [5.63176, 3.04759], [7.30279, 3.38016]])
+        max_iters = 8
+        K = 4
+
+        centroids, idx = run_kmeans(X, K, max_iters,
+                                    initial_centroids=initial_centroids)
+        h_centroids, h_idx = run_kmeans(X, K, max_iters,
+                                        algorithm='hamerly',
+                                        initial_centroids=initial_centroids)
+
+        assert_array_equal(idx, h_idx)
+        assert_allclose(centroids, h_centroids,
+                        rtol=0, atol=1e-10, equal_nan=True)
+
+    def test_run_kmeans_unknown_algorithm(self):
+        X = array([[1, 1], [4, 5], [9, 9], [0, 1]])
+
+        with pytest.raises(ValueError):
+            run_kmeans(X, 2, 5, algorithm='elkan')
+
+    def test_partial_fit_kmeans(self):
+        X = array([[1, 1], [3, 1], [9, 9], [0, 1]])
+        centroids = array([[0, 0], [8, 8]])
+        counts = array([2, 0])
+
+        centroids, counts = partial_fit_kmeans(X, centroids, counts)
+
+        assert_array_equal(counts, array([5, 1]))
+        assert_allclose(centroids, array([[0.8, 0.6], [9, 9]]),
+                        rtol=0, atol=1e-10, equal_nan=False)
+
+    def test_run_minibatch_kmeans1(self):
+        X = array([[5.89562, 2.89844], [5.61754, 2.59751], [5.63176, 3.04759],
+                   [5.50259, 3.11869], [6.48213, 2.55085], [7.30279, 3.38016],
+                   [6.99198, 2.98707], [4.82553, 2.77962], [6.11768, 2.85476],
+                   [0.94049, 5.71557]])
+        K = 3
+        centroids, counts = run_minibatch_kmeans(X, K, batch_size=4,
+                                                 n_epochs=2)
+
+        assert len(centroids) == K
+        assert counts.sum() == 2 * len(X)
+
+    def test_run_minibatch_kmeans2(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+        initial_centroids = array(
+            [[2.9040, 4.6122], [1.2479, 4.9327], [2.9797, 4.8067]])
+        batches = (X[start:(start + 3)] for start in range(0, len(X), 3))
+
+        centroids, counts = run_minibatch_kmeans(
+            X, 3, batch_size=3, initial_centroids=initial_centroids)
+        s_centroids, s_counts = run_minibatch_kmeans(
+            batches, 3, initial_centroids=initial_centroids)
+
+        assert_array_equal(counts, s_counts)
+        assert_allclose(centroids, s_centroids,
+                        rtol=0, atol=1e-10, equal_nan=False)
+
+    def test_run_kmeans_history1(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+        initial_centroids = array(
+            [[2.9040, 4.6122], [1.2479, 4.9327], [2.9797, 4.8067]])
+        max_iters = 50
+        K = 3
+
+        centroids, idx, n_iter, inertia = run_kmeans(
+            X, K, max_iters, initial_centroids=initial_centroids,
+            return_history=True)
+
+        assert n_iter < max_iters
+        assert len(inertia) == n_iter
+        assert all(prev >= cost for prev, cost in zip(inertia, inertia[1:]))
+        assert_almost_equal(inertia[-1], cost_function(X, idx, centroids))
+
+    def test_run_kmeans_history2(self):
+        X = array([[5.89562, 2.89844], [5.61754, 2.59751], [5.63176, 3.04759],
+                   [5.50259, 3.11869], [6.48213, 2.55085], [7.30279, 3.38016],
+                   [6.99198, 2.98707], [4.82553, 2.77962], [6.11768, 2.85476],
+                   [0.94049, 5.71557]])
+        initial_centroids = array([[5.89562, 2.89844], [5.61754, 2.59751],
+                                   [5.63176, 3.04759], [7.30279, 3.38016]])
+        max_iters = 50
+        K = 4
+
+        l_history = run_kmeans(X, K, max_iters,
+                               initial_centroids=initial_centroids,
+                               return_history=True)
+        h_history = run_kmeans(X, K, max_iters, algorithm='hamerly',
+                               initial_centroids=initial_centroids,
+                               return_history=True)
+
+        assert l_history[2] == h_history[2]
+        assert_allclose(l_history[3], h_history[3],
+                        rtol=0, atol=1e-10, equal_nan=False)
+
+    def test_run_kmeans_tol(self):
+        X = array([[5.89562, 2.89844], [5.61754, 2.59751], [5.63176, 3.04759],
+                   [5.50259, 3.11869], [6.48213, 2.55085], [7.30279, 3.38016],
+                   [6.99198, 2.98707], [4.82553, 2.77962], [6.11768, 2.85476],
+                   [0.94049, 5.71557]])
+        initial_centroids = array([[5.89562, 2.89844], [5.61754, 2.59751],
+                                   [5.63176, 3.04759], [7.30279, 3.38016]])
+
+        _, _, n_iter, _ = run_kmeans(X, 4, 50,
+                                     initial_centroids=initial_centroids,
+                                     tol=100, return_history=True)
+
+        assert n_iter == 1
+
+    def test_init_centroids_seed(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+
+        assert_array_equal(init_centroids(X, 4, _seed=3),
+                           init_centroids(X, 4, _seed=3))
+
+    def test_run_intensive_kmeans_n_jobs(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+        max_iters = 10
+        n_inits = 4
+        K = 3
+
+        centroids, idx = run_intensive_kmeans(X, K, max_iters, n_inits,
+                                              n_jobs=1, _seed=11)
+        p_centroids, p_idx = run_intensive_kmeans(X, K, max_iters, n_inits,
+                                                  n_jobs=2, _seed=11)
+
+        assert_array_equal(idx, p_idx)
+        assert_array_equal(centroids, p_centroids)
+
+    def test_elbow_method_n_jobs(self):
+        X = array([[5.89562, 2.89844], [5.61754, 2.59751], [5.63176, 3.04759],
+                   [5.50259, 3.11869], [6.48213, 2.55085], [7.30279, 3.38016],
+                   [6.99198, 2.98707], [4.82553, 2.77962], [6.11768, 2.85476],
+                   [0.94049, 5.71557]])
+        max_iters = 6
+        n_inits = 2
+        K_values = [1, 2, 3, 4]
+
+        cost_values = elbow_method(X, K_values, max_iters, n_inits,
+                                   n_jobs=1, _seed=5)
+        p_cost_values = elbow_method(X, K_values, max_iters, n_inits,
+                                     n_jobs=3, _seed=5)
+
+        assert cost_values == p_cost_values
+
+    def test_init_centroids_kmeans_pp(self):
+        X = array([[0, 0], [0.1, 0], [0, 0.1], [50, 50], [50.1, 50],
+                   [50, 50.1], [-50, 50], [-50.1, 50], [-50, 50.1]])
+        K = 3
+        initial_centroids = init_centroids(X, K, _seed=2, method='kmeans++')
+        idx = find_closest_centroids(X, initial_centroids)
+
+        assert len(initial_centroids) == K
+        assert all(centroid in X for centroid in initial_centroids)
+        assert_array_equal(idx[0:3], idx[0, 0])
+        assert_array_equal(idx[3:6], idx[3, 0])
+        assert_array_equal(idx[6:9], idx[6, 0])
+        assert len(set(idx.flatten())) == K
+
+    def test_init_centroids_kmeans_parallel(self):
+        X = array([[5.89562, 2.89844], [5.61754, 2.59751], [5.63176, 3.04759],
+                   [5.50259, 3.11869], [6.48213, 2.55085], [7.30279, 3.38016],
+                   [6.99198, 2.98707], [4.82553, 2.77962], [6.11768, 2.85476],
+                   [0.94049, 5.71557]])
+        K = 3
+        initial_centroids = init_centroids(X, K, _seed=4, method='kmeans||')
+
+        assert len(initial_centroids) == K
+        assert all(centroid in X for centroid in initial_centroids)
+
+    def test_init_centroids_unknown_method(self):
+        X = array([[1, 1], [4, 5], [9, 9], [0, 1]])
+
+        with pytest.raises(ValueError):
+            init_centroids(X, 2, method='forgy')
+
+    def test_compute_centroids_farthest(self):
+        X = array([[5.89562, 2.89844], [5.61754, 2.59751], [5.63176, 3.04759],
+                   [5.50259, 3.11869], [6.48213, 2.55085], [7.30279, 3.38016],
+                   [6.99198, 2.98707], [4.82553, 2.77962], [6.11768, 2.85476],
+                   [0.94049, 5.71557]])
+        idx = array([[2], [1], [2], [0], [1], [2], [1], [0], [1], [2]])
+        K = 4
+
+        assert_allclose(array([[5.16406, 2.949155],
+                               [6.302333, 2.747548],
+                               [4.942665, 3.76044],
+                               [0.94049, 5.71557]]),
+                        compute_centroids(X, idx, K, empty='farthest'),
+                        rtol=0, atol=0.001, equal_nan=False)
+
+    def test_compute_centroids_unknown_empty(self):
+        X = array([[1, 1], [4, 5], [9, 9], [0, 1]])
+        idx = array([[0], [0], [1], [1]])
+
+        with pytest.raises(ValueError):
+            compute_centroids(X, idx, 2, empty='drop')
+
+    def test_run_kmeans_float32(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+        initial_centroids = array(
+            [[2.9040, 4.6122], [1.2479, 4.9327], [2.9797, 4.8067]])
+        max_iters = 10
+        K = 3
+
+        centroids, idx = run_kmeans(X, K, max_iters,
+                                    initial_centroids=initial_centroids)
+        f_centroids, f_idx = run_kmeans(X, K, max_iters,
+                                        initial_centroids=initial_centroids,
+                                        dtype=float32)
+
+        assert f_centroids.dtype == float32
+        assert f_idx.dtype == int32
+        assert_array_equal(idx, f_idx)
+        assert_allclose(centroids, f_centroids,
+                        rtol=1e-6, atol=0, equal_nan=True)
+
+    def test_compute_centroids_float32(self):
+        X = array([[1.8421, 4.6076], [5.6586, 4.8000], [6.3526, 3.2909],
+                   [2.9040, 4.6122], [3.2320, 4.9399], [1.2479, 4.9327],
+                   [1.9762, 4.4349], [2.2345, 5.0555], [2.9834, 4.8405],
+                   [2.9797, 4.8067]])
+        idx = array([[1], [2], [0], [1], [2], [0], [1], [2], [0], [2]],
+                    dtype=int32)
+        K = 3
+
+        centroids = compute_centroids(X, idx, K, dtype=float32)
+
+        assert centroids.dtype == float32
+        assert_allclose(array([[3.5280, 4.3547],
+                               [2.2408, 4.5516],
+                               [3.5262, 4.9005]]),
+                        centroids,
+                        rtol=0, atol=0.001, equal_nan=False)
+
+    def test_cost_function_float32(self):
+        centroids = array([[-2.4, 2, 0], [2.35, 0, 3.7], [0, 1.8, 0]])
+        X = array([[1, -1, 0], [2.35, 0, 3.7], [-1, -0.9, 1],
+                   [-2.4, 2, 0], [1, -2.3, 1], [0, 1.8, 0]])
+        idx = array([[0], [0], [1], [2], [2], [2]])
+
+        cost = cost_function(X, idx, centroids, dtype=float32)
+        assert_almost_equal(cost, 17.4575, decimal=5)
+
+    def test_find_closest_centroids_dists(self):
+        X = array([[1, 1], [4, 5], [9, 9], [0, 1]])
+        initial_centroids = array([[0, 0], [8, 8]])
+
+        idx, dists = find_closest_centroids(X, initial_centroids,
+                                            return_dists=True)
+
+        assert_array_equal(array([[0], [1], [1], [0]]), idx)
+        assert_allclose(array([[2], [25], [2], [1]]), dists,
+                        rtol=0, atol=1e-10, equal_nan=False)
+
+    def test_cost_function_dists(self):
+        centroids = array([[-2.4, 2, 0], [2.35, 0, 3.7], [0, 1.8, 0]])
+        X = array([[1, -1, 0], [2.35, 0, 3.7], [-1, -0.9, 1],
+                   [-2.4, 2, 0], [1, -2.3, 1], [0, 1.8, 0]])
+        idx, dists = find_closest_centroids(X, centroids, return_dists=True)
+
+        assert_almost_equal(cost_function(X, idx, centroids, dists=dists),
+                            cost_function(X, idx, centroids), decimal=6)
+
+    def test_find_closest_centroids_manhattan(self):
+        X = array([[0, 3], [3, 0], [2, 2], [0, 0]])
+        initial_centroids = array([[0, 0], [2.1, 2.1]])
+
+        idx, dists = find_closest_centroids(X, initial_centroids,
+                                            metric='manhattan',
+                                            return_dists=True)
+
+        assert_array_equal(array([[0], [0], [1], [0]]), idx)
+        assert_allclose(array([[9], [9], [0.04], [0]]), dists,
+                        rtol=0, atol=1e-10, equal_nan=False)
+        assert_almost_equal(cost_function(X, idx, initial_centroids,
+                                          metric='manhattan'),
+                            4.51, decimal=6)
+
+    def test_run_minibatch_kmeans_small_batches(self):
+        rand = RandomState(0)
+        X = rand.normal(size=(60, 2))
+        K = 8
+
+        def stream():
+            return (X[start:(start + 5)] for start in range(0, len(X), 5))
+
+        centroids, counts = run_minibatch_kmeans(stream(), K, _seed=3)
+        assert centroids.shape == (K, 2)
+        assert counts.sum() == len(X)
+
+        p_centroids, _ = run_minibatch_kmeans(stream(), K, _seed=3)
+        assert_array_equal(centroids, p_centroids)
+
+        with pytest.raises(ValueError):
+            run_minibatch_kmeans(iter([X[:5]]), K)
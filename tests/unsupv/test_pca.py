@@ -1,8 +1,10 @@
 import pytest
-from numpy import array
+from numpy import array, abs as absolute, diag, arange
+from numpy.random import RandomState
 from numpy.testing import assert_allclose
 
-from touvlo.unsupv.pca import pca, project_data, recover_data
+from touvlo.unsupv.pca import (pca, project_data, recover_data,
+                               IncrementalPCA, PCA, select_components)
 
 
 class TestPCA:
@@ -131,3 +133,124 @@ class TestPCA:
                                [1.507115, 1.507115],
                                [0.311804, 0.311804]]),
                         rtol=0, atol=0.001, equal_nan=False)
+
+    def test_pca_top_k(self, X):
+        U, S = pca(X)
+        U_k, S_k = pca(X, k=1)
+
+        assert U_k.shape == (2, 1)
+        assert S_k.shape == (1,)
+        assert_allclose(U_k, U[:, :1])
+        assert_allclose(S_k, diag(S)[:1])
+
+    def test_pca_randomized(self):
+        rand = RandomState(0)
+        X = rand.normal(size=(300, 8)).dot(rand.normal(size=(8, 60)))
+        X += 0.01 * rand.normal(size=X.shape)
+        U, S = pca(X)
+
+        U_k, S_k = pca(X, k=5, method='randomized', _seed=1)
+        assert U_k.shape == (60, 5)
+        assert S_k.shape == (5,)
+        assert_allclose(S_k, diag(S)[:5], rtol=1e-6)
+        # components are only defined up to their sign
+        assert_allclose(absolute(U_k.T.dot(U[:, :5])), diag([1] * 5),
+                        atol=1e-6)
+
+    def test_pca_method(self, X):
+        with pytest.raises(ValueError):
+            pca(X, method='randomized')
+
+        with pytest.raises(ValueError):
+            pca(X, k=1, method='arpack')
+
+    def test_incremental_pca(self, X_norm):
+        U, S = pca(X_norm)
+        inc = IncrementalPCA(k=2).fit(X_norm, batch_size=6)
+
+        assert inc.count == len(X_norm)
+        assert_allclose(inc.S, diag(S))
+        assert_allclose(absolute(inc.U.T.dot(U)), diag([1, 1]), atol=1e-8)
+        assert_allclose(inc.explained_variance_ratio.sum(), 1)
+        assert_allclose(absolute(project_data(X_norm, inc.U, 1)),
+                        absolute(project_data(X_norm, U, 1)))
+
+    def test_incremental_pca_batches(self):
+        rand = RandomState(0)
+        X = rand.normal(size=(400, 3)).dot(rand.normal(size=(3, 20)))
+        U, S = pca(X, k=3)
+
+        inc = IncrementalPCA(k=3)
+        inc.fit(X[start:(start + 64)] for start in range(0, len(X), 64))
+        assert inc.count == len(X)
+        assert_allclose(inc.S, S)
+        assert_allclose(absolute(inc.U.T.dot(U)), diag([1] * 3), atol=1e-8)
+
+        inc.fit(X, batch_size=100)
+        assert inc.count == len(X)
+        assert_allclose(inc.S, S)
+
+    def test_pca_transformer(self, X):
+        U, _ = pca(X)
+        transformer = PCA(U, k=1, chunk_size=3)
+
+        assert transformer.U_reduce.flags['C_CONTIGUOUS']
+        Z = transformer.transform(X)
+        assert_allclose(Z, project_data(X, U, 1))
+
+        X_rec = transformer.inverse_transform(Z)
+        assert_allclose(X_rec, recover_data(Z, U, 1))
+
+        assert_allclose(transformer.reconstruction_error(X),
+                        ((X - X_rec) ** 2).sum(axis=1), atol=1e-10)
+
+    def test_pca_transformer_fit(self, X_norm):
+        U, _ = pca(X_norm)
+        transformer = PCA.fit(X_norm, 1, chunk_size=7)
+
+        assert transformer.U_reduce.shape == (2, 1)
+        assert_allclose(transformer.transform(X_norm),
+                        project_data(X_norm, U, 1))
+        assert_allclose(PCA(U).reconstruction_error(X_norm), 0, atol=1e-10)
+
+    def test_select_components(self):
+        S = array([4, 3, 2, 1])
+
+        assert select_components(S, 0.4) == 1
+        assert select_components(S, 0.5) == 2
+        assert select_components(S, 0.95) == 4
+        assert select_components(S, 1) == 4
+        assert select_components(diag(S), 0.7) == 2
+        assert select_components(S[:2], 0.5, total=10) == 2
+        assert select_components(S[:2], 0.9, total=10) == 2
+
+    def test_pca_retained(self):
+        rand = RandomState(0)
+        X = rand.normal(size=(500, 40)) * (0.8 ** arange(40))
+        U, S = pca(X)
+        k = select_components(S, 0.9)
+
+        U_k, S_k = pca(X, retained=0.9)
+        assert_allclose(U_k, U[:, :k])
+        assert_allclose(S_k, diag(S)[:k])
+
+        U_k, S_k = pca(X, method='subspace', retained=0.9, block_size=4,
+                       _seed=0)
+        assert U_k.shape == (40, k)
+        assert_allclose(S_k, diag(S)[:k])
+        assert_allclose(absolute(U_k.T.dot(U[:, :k])), diag([1] * k),
+                        atol=1e-6)
+
+        with pytest.raises(ValueError):
+            pca(X, method='subspace')
+
+    def test_reconstruction_error_small(self):
+        rand = RandomState(0)
+        X = 1e3 + rand.normal(size=(200, 10))
+        X[:, 9] = 1e3 + 1e-6 * rand.normal(size=200)
+        U, _ = pca(X)
+        transformer = PCA(U, k=9, chunk_size=64)
+
+        X_rec = recover_data(project_data(X, U, 9), U, 9)
+        assert_allclose(transformer.reconstruction_error(X),
+                        ((X - X_rec) ** 2).sum(axis=1), rtol=1e-6)
@@ -5,8 +5,14 @@
 .. moduleauthor:: Benardi Nunes <benardinunes@gmail.com>
 """
 
-from numpy import power, multiply, where, zeros, reshape, append
+from numpy import (power, multiply, where, zeros, reshape, nonzero, einsum,
+                   identity, empty, random, dot, subtract, copyto,
+                   result_type, not_equal, searchsorted, arange)
 from numpy import sum as add
+from numpy.linalg import solve
+from numpy.random import RandomState
+
+from touvlo.utils import group_sums, map_chunks
 
 
 def unravel_params(params, num_users, num_products, num_features):
@@ -20,7 +26,8 @@ def unravel_params(params, num_users, num_products, num_features):
 
     Returns:
         (numpy.array, numpy.array): A 2-tuple consisting of a matrix of
-        product features and a matrix of user features.
+        product features and a matrix of user features. Both are views into
+        params rather than copies, so writing to them updates params.
     """
     X = params[0:(num_products * num_features)]
     X = reshape(X, (num_products, num_features))
@@ -52,6 +59,10 @@ def cost_function(X, Y, R, theta, _lambda):
 def grad(params, Y, R, num_users, num_products, num_features, _lambda):
     """Calculates gradient of Collaborative Filtering's parameters
 
+    The residual of the predictions is masked to the rated entries once,
+    and the gradients of product and user features both follow from a
+    single matrix product with it, as in `cost_and_grad`.
+
     Args:
         params (numpy.array): flattened product and user features..
         Y (numpy.array): Scores' matrix.
@@ -65,21 +76,357 @@ def grad(params, Y, R, num_users, num_products, num_features, _lambda):
         numpy.array: Flattened gradient of product and user parameters.
     """
 
+    return cost_and_grad(params, Y, R, num_users, num_products,
+                         num_features, _lambda)[1]
+
+
+def _fill_cost_and_grad(params, Y, unrated, _lambda, dims, err, grad,
+                        scratch):
+    """Computes the cost and writes the gradient into grad.
+
+    The residual of the predictions, masked to the rated entries, is
+    written into err, and the products of the gradient into scratch, so
+    that nothing is allocated given arrays of the right dtype and shape.
+    """
+    X, theta = unravel_params(params, *dims)
+    X_scratch, theta_scratch = unravel_params(scratch, *dims)
+
+    # residual of the rated entries only, 0 elsewhere
+    dot(X, theta.T, out=err)
+    subtract(err, Y, out=err)
+    copyto(err, 0, where=unrated)
+    J = (1 / 2) * einsum('ij,ij->', err, err)
+    J = J + (_lambda / 2) * params.dot(params)
+
+    dot(err, theta, out=X_scratch)
+    dot(err.T, X, out=theta_scratch)
+    multiply(params, _lambda, out=grad)
+    grad += scratch
+    return J
+
+
+def cost_and_grad(params, Y, R, num_users, num_products, num_features,
+                  _lambda):
+    """Computes both the cost function J and the gradient of Collaborative
+    Filtering's parameters
+
+    Predictions and their residual, masked to the rated entries, are
+    computed once and shared by cost and gradient, rather than once by each
+    of `cost_function` and `grad`.
+
+    Args:
+        params (numpy.array): flattened product and user features.
+        Y (numpy.array): Scores' matrix.
+        R (numpy.array): Matrix of 0s and 1s (whether there's a rating).
+        num_users (int): Number of users in this instance.
+        num_products (int): Number of products in this instance.
+        num_features (int): Number of features in this instance.
+        _lambda (float): The regularization hyperparameter.
+
+    Returns:
+        (float, numpy.array): A 2-tuple of the computed cost and the
+            flattened gradient of product and user parameters.
+    """
+    dtype = result_type(params, Y, 1.0)
+    params = params.astype(dtype, copy=False)
+    flat_params = empty(params.shape, dtype=dtype)
+    J = _fill_cost_and_grad(params, Y, R != 1, _lambda,
+                            (num_users, num_products, num_features),
+                            empty((num_products, num_users), dtype=dtype),
+                            flat_params, empty(params.shape, dtype=dtype))
+    return J, flat_params
+
+
+def to_triplets(Y, R):
+    """Converts dense scores' and rating matrices into rating triplets.
+
+    Args:
+        Y (numpy.array): Scores' matrix.
+        R (numpy.array): Matrix of 0s and 1s (whether there's a rating).
+
+    Returns:
+        (numpy.array, numpy.array, numpy.array): A 3-tuple of the product
+            indices, the user indices and the scores of every rating.
+    """
+    products, users = nonzero(R == 1)
+    return products, users, Y[products, users]
+
+
+def _sparse_residuals(X, theta, products, users, ratings, chunk_size):
+    """Yields the products, users and prediction minus score of every
+    chunk of rating triplets."""
+    for start in range(0, len(ratings), chunk_size):
+        stop = start + chunk_size
+        chunk_products = products[start:stop]
+        chunk_users = users[start:stop]
+        err = einsum('ij,ij->i', X[chunk_products], theta[chunk_users])
+        err -= ratings[start:stop]
+        yield chunk_products, chunk_users, err
+
+
+def sparse_cost_function(X, products, users, ratings, theta, _lambda,
+                         chunk_size=65536):
+    """Computes the cost function J for Collaborative Filtering from rating
+    triplets.
+
+    Only the observed ratings are visited, `chunk_size` of them at a time,
+    so neither the scores' matrix, the full matrix of predictions nor
+    per-rating copies of the features are ever allocated. Gives the same
+    cost as `cost_function` with the dense matrices the triplets come from.
+
+    Args:
+        X (numpy.array): Matrix of product features.
+        products (numpy.array): Product (row) index of each rating.
+        users (numpy.array): User (column) index of each rating.
+        ratings (numpy.array): Score of each rating.
+        theta (numpy.array): Matrix of user features.
+        _lambda (float): The regularization hyperparameter.
+        chunk_size (int): Number of ratings handled at a time.
+
+    Returns:
+        float: Computed cost.
+    """
+    J = 0
+    for _, _, err in _sparse_residuals(X, theta, products, users, ratings,
+                                       chunk_size):
+        J = J + (1 / 2) * err.dot(err)
+    J = J + (_lambda / 2) * add(power(theta, 2))
+    J = J + (_lambda / 2) * add(power(X, 2))
+    return J
+
+
+def sparse_grad(params, products, users, ratings, num_users, num_products,
+                num_features, _lambda, chunk_size=65536):
+    """Calculates gradient of Collaborative Filtering's parameters from
+    rating triplets
+
+    Only the observed ratings are visited, `chunk_size` of them at a time,
+    and each chunk's contribution is summed into the gradient of the
+    products and users it rates. Gives the same gradient as `grad` with the
+    dense matrices the triplets come from.
+
+    Args:
+        params (numpy.array): flattened product and user features.
+        products (numpy.array): Product (row) index of each rating.
+        users (numpy.array): User (column) index of each rating.
+        ratings (numpy.array): Score of each rating.
+        num_users (int): Number of users in this instance.
+        num_products (int): Number of products in this instance.
+        num_features (int): Number of features in this instance.
+        _lambda (float): The regularization hyperparameter.
+        chunk_size (int): Number of ratings handled at a time.
+
+    Returns:
+        numpy.array: Flattened gradient of product and user parameters.
+    """
     X, theta = unravel_params(params, num_users, num_products, num_features)
-    X_grad = zeros(X.shape)
-    theta_grad = zeros(theta.shape)
-
-    for i in range(num_products):
-        idx = where(R[i, :] == 1)  # users that have rated product i
-        X_grad[i, :] = (X[i, :].dot(theta[idx].T)
-                        - Y[i, idx[0]]).dot(theta[idx])
-        X_grad[i, :] = X_grad[i, :] + _lambda * X[i, :]
-
-    for j in range(num_users):
-        idx = where(R[:, j] == 1)  # products that have been rated by user j
-        theta_grad[j, :] = (theta[j, :].dot(
-            X[idx].T) - Y[idx[0], j]).dot(X[idx])
-        theta_grad[j, :] = theta_grad[j, :] + _lambda * theta[j, :]
-
-    flat_params = append(X_grad.flatten(), theta_grad.flatten())
+    flat_params = empty(params.shape)
+    X_grad, theta_grad = unravel_params(flat_params, num_users,
+                                        num_products, num_features)
+    multiply(params, _lambda, out=flat_params)
+
+    for chunk_products, chunk_users, err in _sparse_residuals(
+            X, theta, products, users, ratings, chunk_size):
+        err = err[:, None]
+        group_sums(chunk_products, err * theta[chunk_users], num_products,
+                   chunk_size=chunk_size, out=X_grad)
+        group_sums(chunk_users, err * X[chunk_products], num_users,
+                   chunk_size=chunk_size, out=theta_grad)
+
     return flat_params
+
+
+def _solve_factors(rated, Y, F, _lambda, out, block_size, n_jobs):
+    """Solves the regularized least squares problem of every row of out.
+
+    Row i of out gets (F_i^T F_i + _lambda I)^-1 F_i^T y_i, the features that
+    best predict the scores y_i of row i, where F_i holds the rows of the
+    fixed features F its scores were given to. Each row's Gram matrix is a
+    single matrix product over its rated columns only, so a sweep costs
+    O(ratings x features^2). Rows are independent, so the systems of a
+    block of them are stacked and solved at once, and blocks are spread
+    over threads.
+    """
+    num_features = F.shape[1]
+    reg = _lambda * identity(num_features)
+
+    def solve_block(start):
+        stop = start + block_size
+        block_Y = Y[start:stop]
+        num_rows = len(block_Y)
+        rows, cols = nonzero(rated[start:stop])
+        # rows come out sorted, so each row's columns are a segment of cols
+        bounds = searchsorted(rows, arange(num_rows + 1))
+
+        A = empty((num_rows, num_features, num_features))
+        b = empty((num_rows, num_features))
+        for i in range(num_rows):
+            row_cols = cols[bounds[i]:bounds[i + 1]]
+            F_i = F[row_cols]
+            dot(F_i.T, F_i, out=A[i])
+            dot(F_i.T, block_Y[i, row_cols], out=b[i])
+
+        A += reg
+        out[start:stop] = solve(A, b[:, :, None])[:, :, 0]
+
+    map_chunks(solve_block, len(out), block_size, n_jobs)
+
+
+def run_als(Y, R, num_features, _lambda, num_iters, initial_params=None,
+            tol=0, block_size=256, n_jobs=1, return_history=False,
+            _seed=None):
+    """Fits Collaborative Filtering's parameters by Alternating Least Squares
+
+    Each sweep holds the user features fixed and solves, for every product,
+    the regularized least squares problem over the users that rated it,
+    then does likewise for every user with the new product features. Each
+    sweep can only lower `cost_function`, and far fewer sweeps than
+    gradient steps are usually needed.
+
+    Args:
+        Y (numpy.array): Scores' matrix.
+        R (numpy.array): Matrix of 0s and 1s (whether there's a rating).
+        num_features (int): Number of features in this instance.
+        _lambda (float): The regularization hyperparameter.
+        num_iters (int): Most sweeps over products and users to perform.
+        initial_params (numpy.array): flattened product and user features
+            to start from. Defaults to None, in which case small random
+            values are drawn.
+        tol (float): Relative decrease of the cost under which a sweep is
+            considered to have converged, stopping the run.
+        block_size (int): Number of products or users solved at a time.
+        n_jobs (int): Number of threads blocks are spread over, -1 meaning
+            one per CPU.
+        return_history (bool): Whether to also return the cost after each
+            sweep.
+        _seed (int): Seed to make the initial features reproducible.
+
+    Raises:
+        LinAlgError: If _lambda is 0 and a product or user has fewer
+            ratings than there are features.
+
+    Returns:
+        numpy.array: Flattened product and user features, as expected by
+            `unravel_params`. If `return_history` is set a 2-tuple is
+            returned instead, with the list of costs after the features.
+    """
+    num_products, num_users = Y.shape
+    if initial_params is None:
+        rand = random if _seed is None else RandomState(_seed)
+        initial_params = 0.1 * rand.normal(
+            size=(num_products + num_users) * num_features)
+
+    params = empty((num_products + num_users) * num_features)
+    params[:] = initial_params
+    X, theta = unravel_params(params, num_users, num_products, num_features)
+
+    rated = R == 1
+    Y_obs = where(rated, Y, 0)
+    J_history = []
+    for _ in range(num_iters):
+        _solve_factors(rated, Y, theta, _lambda, X, block_size, n_jobs)
+        _solve_factors(rated.T, Y.T, X, _lambda, theta, block_size, n_jobs)
+
+        J_history.append(cost_function(X, Y_obs, rated, theta, _lambda))
+        if (len(J_history) > 1
+                and J_history[-2] - J_history[-1] <= tol * J_history[-2]):
+            break
+
+    if return_history:
+        return params, J_history
+    return params
+
+
+class ParamBuffer:
+    """Packs Collaborative Filtering's parameters and gradient into
+    preallocated flat arrays.
+
+    Product and user features, and their gradients, are views into the
+    flat `params` and `grad` arrays, laid out as `unravel_params` expects,
+    so optimizers read and update them in place. Along with a scratch array
+    and a products x users residual buffer, every array is allocated once,
+    and gradient evaluations and descent steps allocate nothing.
+
+    Args:
+        num_users (int): Number of users in this instance.
+        num_products (int): Number of products in this instance.
+        num_features (int): Number of features in this instance.
+        params (numpy.array): flattened product and user features to start
+            from. Defaults to None, in which case small random values are
+            drawn, as features all at 0 would have a null gradient.
+        _seed (int): Seed to make the initial features reproducible.
+
+    Attributes:
+        params (numpy.array): flattened product and user features.
+        grad (numpy.array): Flattened gradient of product and user
+            parameters, as of the last call to `cost_and_grad`.
+        X (numpy.array): Matrix of product features, a view into params.
+        theta (numpy.array): Matrix of user features, a view into params.
+        X_grad (numpy.array): Gradient of product features, a view into
+            grad.
+        theta_grad (numpy.array): Gradient of user features, a view into
+            grad.
+    """
+
+    def __init__(self, num_users, num_products, num_features, params=None,
+                 _seed=None):
+        size = (num_products + num_users) * num_features
+        if params is None:
+            rand = random if _seed is None else RandomState(_seed)
+            params = 0.1 * rand.normal(size=size)
+        self.params = empty(size)
+        self.params[:] = params
+        self.grad = zeros(size)
+        self._scratch = zeros(size)
+
+        self._dims = (num_users, num_products, num_features)
+        self.X, self.theta = unravel_params(self.params, *self._dims)
+        self.X_grad, self.theta_grad = unravel_params(self.grad, *self._dims)
+        self._err = zeros((num_products, num_users))
+        self._unrated = empty((num_products, num_users), dtype=bool)
+
+    def cost_and_grad(self, Y, R, _lambda):
+        """Computes the cost function J and writes the gradient into grad.
+
+        Args:
+            Y (numpy.array): Scores' matrix.
+            R (numpy.array): Matrix of 0s and 1s (whether there's a rating).
+            _lambda (float): The regularization hyperparameter.
+
+        Returns:
+            float: Computed cost.
+        """
+        not_equal(R, 1, out=self._unrated)
+
+        return _fill_cost_and_grad(self.params, Y, self._unrated, _lambda,
+                                   self._dims, self._err, self.grad,
+                                   self._scratch)
+
+    def step(self, alpha):
+        """Moves the parameters against the current gradient, in place.
+
+        Args:
+            alpha (float): Learning rate or _step size of the optimization.
+        """
+        multiply(self.grad, alpha, out=self._scratch)
+        self.params -= self._scratch
+
+    def fit(self, Y, R, _lambda, alpha, num_iters):
+        """Optimizes the parameters in place via Batch Gradient Descent.
+
+        Args:
+            Y (numpy.array): Scores' matrix.
+            R (numpy.array): Matrix of 0s and 1s (whether there's a rating).
+            _lambda (float): The regularization hyperparameter.
+            alpha (float): Learning rate or _step size of the optimization.
+            num_iters (int): Number of times the optimization will be
+                performed.
+
+        Returns:
+            list: The cost before each step.
+        """
+        J_history = []
+        for _ in range(num_iters):
+            J_history.append(self.cost_and_grad(Y, R, _lambda))
+            self.step(alpha)
+        return J_history
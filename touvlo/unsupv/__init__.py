@@ -1,5 +1,6 @@
 from touvlo.unsupv import anmly_detc
+from touvlo.unsupv import dist
 from touvlo.unsupv import kmeans
 from touvlo.unsupv import pca
 
-__all__ = ['anmly_detc', 'kmeans', 'pca']
+__all__ = ['anmly_detc', 'dist', 'kmeans', 'pca']
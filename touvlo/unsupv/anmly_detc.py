@@ -5,15 +5,19 @@
 .. moduleauthor:: Benardi Nunes <benardinunes@gmail.com>
 """
 
-from functools import reduce
 from math import pi
 
-from numpy import array, mean, var, sqrt, exp, power, sum, multiply
-from numpy.linalg import det, inv
+from numpy import (mean, var, sqrt, exp, power, sum, multiply, prod,
+                   log, identity, diagonal, asarray, uint8, flatnonzero,
+                   outer, cumsum, concatenate, searchsorted, linspace,
+                   divide, zeros, argmax, result_type, subtract)
+from numpy.linalg import cholesky
+
+from touvlo.utils import iter_batches
 
 
 # predict function
-def is_anomaly(p, threshold=0.5):
+def is_anomaly(p, threshold=0.5, output='column'):
     """Predicts whether a probability falls into class 1 (anomaly).
 
     Args:
@@ -21,28 +25,66 @@ def is_anomaly(p, threshold=0.5):
             anomaly).
         threshold (float): point below which an example is considered of class
             1.
+        output (str): How predictions should be returned:
+
+         * 'column': Column vector of 0s and 1s.
+         * 'mask': Flat array of booleans, True for anomalies.
+         * 'uint8': Flat array of 0s and 1s taking a byte each.
+         * 'indices': Flat array with the indices of anomalies only.
 
     Returns:
-        int: Binary value to denote class 1 or 0
+        numpy.array: Binary value to denote class 1 or 0 for each example,
+            or indices of class 1 examples, depending on `output`.
     """
-    prediction = array([[1] if el < threshold else [0] for el in p])
-    return prediction
+    mask = asarray(p).ravel() < threshold
+
+    if output == 'column':
+        return mask.astype(int)[:, None]
+    elif output == 'mask':
+        return mask
+    elif output == 'uint8':
+        return mask.view(uint8)
+    elif output == 'indices':
+        return flatnonzero(mask)
 
+    raise ValueError("The output parameter for is_anomaly should be "
+                     "'column', 'mask', 'uint8' or 'indices', '%s' was "
+                     "passed." % output)
 
-def cov_matrix(X, mu):
+
+def cov_matrix(X, mu, chunk_size=4096, dtype=None):
     """Calculates the covariance matrix for matrix X (m x n).
 
+    The Gram matrix of the deviations from the mean is accumulated over
+    blocks of `chunk_size` rows, so that only one block of them is held in
+    memory at a time rather than a copy of the whole of X. X may also be a
+    memory-mapped array or an iterator over blocks of rows.
+
     Args:
-        X (numpy.array): Features' dataset.
+        X (numpy.array): Features' dataset, or an iterator over blocks of
+            its rows.
         mu (numpy.array): Mean of each feature/column of.
+        chunk_size (int): Number of rows handled at a time.
+        dtype (numpy.dtype): Floating point type the covariance is
+            accumulated in. Defaults to None, in which case it follows X
+            and mu.
 
     Returns:
-        int: Covariance matrix (n x n)
+        numpy.array: Covariance matrix (n x n)
     """
-    m, n = X.shape
-    X_minus_mu = X - mu
-    sigma = (1 / m) * (X_minus_mu.T).dot(X_minus_mu)
-
+    n = len(mu)
+    if dtype is None:
+        dtype = result_type(getattr(X, 'dtype', mu), mu, 1.0)
+    mu = asarray(mu, dtype=dtype)
+    sigma = zeros((n, n), dtype=dtype)
+
+    m = 0
+    for chunk in iter_batches(X, chunk_size):
+        X_minus_mu = subtract(chunk, mu, dtype=dtype)
+        sigma += (X_minus_mu.T).dot(X_minus_mu)
+        m += len(chunk)
+
+    sigma /= m
     return sigma
 
 
@@ -79,61 +121,307 @@ def estimate_multi_gaussian(X):
     return mu, sigma
 
 
-def uni_gaussian(X, mu, sigma2):
+class GaussianEstimator:
+    """Estimates Gaussian parameters from data seen a batch at a time.
+
+    Keeps the number of examples seen, their mean and the sum of squared
+    deviations from it (M2), which are updated with each batch, or
+    combined with another estimator's, through Chan et al.'s parallel
+    update. The resulting parameters are those `estimate_uni_gaussian`
+    and `estimate_multi_gaussian` would have estimated from all of the
+    data at once, so chunks read from disk or estimators fitted on
+    different processes can be used in place of the whole dataset.
+
+    Args:
+        covariance (bool): Whether to keep track of the whole covariance
+            matrix (n x n) or only of the variance of each feature (n),
+            which is enough for the Univariate Gaussian. Defaults to True.
+
+    Attributes:
+        count (int): Number of examples seen.
+        mu (numpy.array): Mean of each feature/column seen.
+        M2 (numpy.array): Sum of squared deviations from the mean, matrix
+            of cross products if `covariance` is set.
+    """
+
+    def __init__(self, covariance=True):
+        self.covariance = covariance
+        self.count = 0
+        self.mu = None
+        self.M2 = None
+
+    def _deviations(self, X, mu):
+        X_minus_mu = X - mu
+        if self.covariance:
+            return (X_minus_mu.T).dot(X_minus_mu)
+        return sum(power(X_minus_mu, 2), axis=0)
+
+    def _combine(self, count, mu, M2):
+        if self.count == 0:
+            self.count, self.mu, self.M2 = count, mu, M2
+            return self
+
+        total = self.count + count
+        delta = mu - self.mu
+        if self.covariance:
+            spread = outer(delta, delta)
+        else:
+            spread = power(delta, 2)
+
+        self.M2 = self.M2 + M2 + spread * (self.count * count / total)
+        self.mu = self.mu + delta * (count / total)
+        self.count = total
+        return self
+
+    def partial_fit(self, X):
+        """Updates the estimate with a batch of examples.
+
+        Args:
+            X (numpy.array): Batch of the features' dataset.
+
+        Returns:
+            GaussianEstimator: The updated estimator itself.
+        """
+        if len(X) == 0:
+            return self
+        mu = mean(X, axis=0)
+        return self._combine(len(X), mu, self._deviations(X, mu))
+
+    def merge(self, other):
+        """Updates the estimate with that of another estimator.
+
+        Args:
+            other (GaussianEstimator): Estimator fitted on other examples.
+
+        Returns:
+            GaussianEstimator: The updated estimator itself.
+        """
+        if other.count == 0:
+            return self
+        return self._combine(other.count, other.mu, other.M2)
+
+    @property
+    def sigma2(self):
+        """numpy.array: Variance of each feature/column seen."""
+        if self.covariance:
+            return diagonal(self.M2) / self.count
+        return self.M2 / self.count
+
+    @property
+    def sigma(self):
+        """numpy.array: Covariance matrix for the examples seen."""
+        return self.M2 / self.count
+
+
+def uni_gaussian(X, mu, sigma2, log_pdf=False):
     """Estimates probability that examples belong to Univariate Gaussian.
 
     Args:
         X (numpy.array): Features' dataset.
         mu (numpy.array): Mean of each feature/column of X.
         sigma2 (numpy.array): Variance of each feature/column of X.
+        log_pdf (bool): Whether to return the logarithm of the density
+            instead, obtained by summing rather than multiplying over
+            features so that it doesn't underflow when there are hundreds
+            of them.
 
     Returns:
         numpy.array: Probability density function for each example
     """
+    if log_pdf:
+        p = -(1 / 2) * log(2 * pi * sigma2)
+        p = p - power(X - mu, 2) / (2 * sigma2)
+        return sum(p, axis=1, keepdims=True)
+
     p = (1 / sqrt(2 * pi * sigma2))
     p = p * exp(-power(X - mu, 2) / (2 * sigma2))
-
-    def prod(x, y):
-        return x * y
-    p = array([[reduce(prod, el)] for el in p])
+    p = prod(p, axis=1, keepdims=True)
 
     return p
 
 
-def multi_gaussian(X, mu, sigma):
+def multi_gaussian(X, mu, sigma, log_pdf=False, reg=0):
     """Estimates probability that examples belong to Multivariate Gaussian.
 
+    Factorizes sigma on every call; create a `MultiGaussian` once to score
+    several batches with the same parameters.
+
     Args:
         X (numpy.array): Features' dataset.
         mu (numpy.array): Mean of each feature/column of X.
         sigma (numpy.array): Covariance matrix for X.
+        log_pdf (bool): Whether to return the logarithm of the density
+            instead.
+        reg (float): Value added to the diagonal of sigma before it is
+            factorized, which makes singular covariances usable.
+            Defaults to 0.
+
+    Raises:
+        LinAlgError
 
     Returns:
         numpy.array: Probability density function for each example
     """
-    m, n = X.shape
-    X = X - mu
+    return MultiGaussian(mu, sigma, reg=reg)(X, log_pdf=log_pdf)
 
-    factor = X.dot(inv(sigma))
-    factor = multiply(factor, X)
-    factor = - (1 / 2) * sum(factor, axis=1, keepdims=True)
 
-    p = 1 / (power(2 * pi, n / 2) * sqrt(det(sigma)))
-    p = p * exp(factor)
+def _lower_inv(L):
+    """Inverts a lower triangular matrix by forward substitution.
 
-    return p
+    Row j of the inverse only depends on rows before it, so the inverse is
+    filled a row at a time without pivoting, which keeps it triangular and
+    as accurate as a triangular solve.
+    """
+    n = len(L)
+    L_inv = zeros((n, n), dtype=result_type(L, 1.0))
+    for j in range(n):
+        L_inv[j, :j] = - L[j, :j].dot(L_inv[:j, :j]) / L[j, j]
+        L_inv[j, j] = 1 / L[j, j]
+    return L_inv
+
+
+class MultiGaussian:
+    """Represents a Multivariate Gaussian density ready to score examples.
+
+    The covariance matrix is factorized once, as sigma = L L^T (Cholesky),
+    when the density is created, and L is inverted by forward
+    substitution. The explicit inverse is kept, rather than solving with L
+    for every batch, because numpy has no triangular solver: scoring a
+    batch is then a single matrix product with it, instead of inverting
+    sigma and computing its determinant on every call. The log-determinant
+    is taken from the factor's diagonal so it doesn't overflow or
+    underflow for near-singular covariances.
+
+    Args:
+        mu (numpy.array): Mean of each feature/column.
+        sigma (numpy.array): Covariance matrix.
+        reg (float): Value added to the diagonal of sigma before it is
+            factorized, which makes singular covariances usable.
+            Defaults to 0.
+
+    Raises:
+        LinAlgError
+
+    Attributes:
+        mu (numpy.array): Mean of each feature/column.
+        L_inv (numpy.array): Inverse of the lower triangular Cholesky
+            factor of sigma.
+        log_det (float): Logarithm of the determinant of sigma.
+    """
+
+    def __init__(self, mu, sigma, reg=0):
+        n = len(sigma)
+        L = cholesky(sigma + reg * identity(n))
+        self.mu = mu
+        self.L_inv = _lower_inv(L)
+        self.log_det = 2 * sum(log(diagonal(L)))
+
+    @classmethod
+    def fit(cls, X, reg=0):
+        """Creates the density whose parameters are estimated from X.
+
+        Args:
+            X (numpy.array): Features' dataset.
+            reg (float): Value added to the diagonal of the covariance
+                matrix before it is factorized.
+
+        Returns:
+            MultiGaussian: Fitted density.
+        """
+        mu, sigma = estimate_multi_gaussian(X)
+        return cls(mu, sigma, reg=reg)
+
+    def log_pdf(self, X):
+        """Computes the logarithm of the density for each example.
+
+        Args:
+            X (numpy.array): Features' dataset.
+
+        Returns:
+            numpy.array: Column vector of log-densities.
+        """
+        n = len(self.L_inv)
+        Z = (X - self.mu).dot(self.L_inv.T)
+        mahalanobis = sum(multiply(Z, Z), axis=1, keepdims=True)
+        return - (1 / 2) * (n * log(2 * pi) + self.log_det + mahalanobis)
+
+    def pdf(self, X):
+        """Computes the density for each example.
+
+        Args:
+            X (numpy.array): Features' dataset.
 
+        Returns:
+            numpy.array: Column vector of densities.
+        """
+        return exp(self.log_pdf(X))
 
-def predict(X, epsilon, gaussian, **kwargs):
+    def __call__(self, X, log_pdf=False):
+        if log_pdf:
+            return self.log_pdf(X)
+        return self.pdf(X)
+
+
+def predict(X, epsilon, gaussian, output='column', **kwargs):
     """Predicts whether examples are anomalies.
 
     Args:
         X (numpy.array): Features' dataset.
         epsilon (float): point below which an example is considered of class 1.
         gaussian (numpy.array): Function that estimates pertinency probability.
+        output (str): How predictions should be returned, as in
+            `is_anomaly`.
 
     Returns:
         numpy.array: Column vector of classification
     """
     p = gaussian(X=X, **kwargs)
-    return is_anomaly(p, threshold=epsilon)
+    return is_anomaly(p, threshold=epsilon, output=output)
+
+
+def select_epsilon(X, y, gaussian, epsilons=None, n_epsilons=1000,
+                   **kwargs):
+    """Picks the epsilon that best tells anomalies apart in labelled data.
+
+    Densities are computed and sorted once, and the number of anomalies
+    flagged under every candidate epsilon is found by binary search. A
+    cumulative count of true anomalies along the sorted densities then
+    gives the true positives, and so the F1 score, of all candidates at
+    once.
+
+    Args:
+        X (numpy.array): Features' dataset of the validation set.
+        y (numpy.array): Column vector with 1 for each anomaly of X and 0
+            otherwise.
+        gaussian (function): Function that estimates pertinency
+            probability, as in `predict`.
+        epsilons (numpy.array): Candidate epsilons. Defaults to None, in
+            which case `n_epsilons` evenly spaced values between the
+            lowest and highest density are used.
+        n_epsilons (int): Number of candidates when no `epsilons` are
+            given.
+
+    Returns:
+        (float, float): A 2-tuple of the epsilon with the highest F1 score
+            and that score.
+    """
+    p = asarray(gaussian(X=X, **kwargs)).ravel()
+    y = asarray(y).ravel()
+    order = p.argsort(kind='stable')
+    sorted_p = p[order]
+
+    if epsilons is None:
+        epsilons = linspace(sorted_p[0], sorted_p[-1], n_epsilons)
+    epsilons = asarray(epsilons).ravel()
+
+    # anomalies among the k lowest densities, for k = 0..m
+    true_pos = concatenate(([0], cumsum(y[order] != 0)))
+    flagged = searchsorted(sorted_p, epsilons, side='left')
+    tp = true_pos[flagged]
+
+    # F1 = 2 * tp / (2 * tp + fp + fn) = 2 * tp / (flagged + positives)
+    denom = flagged + true_pos[-1]
+    F1 = divide(2 * tp, denom, out=zeros(len(epsilons)), where=denom > 0)
+
+    best = argmax(F1)
+    return epsilons[best], F1[best]
@@ -0,0 +1,266 @@
+"""
+.. module:: dist
+    :synopsis: Provides routines to compute distances between sets of points.
+
+.. moduleauthor:: Benardi Nunes <benardinunes@gmail.com>
+"""
+
+from math import inf
+
+from numpy import (dot, einsum, maximum, sqrt, abs as absolute, zeros,
+                   int64, result_type, isnan, argmin, take_along_axis,
+                   divide, clip, outer, subtract)
+from numpy import sum as add
+
+from touvlo.utils import map_chunks
+
+
+def sq_euclidean(A, B, out=None):
+    """Calculates squared Euclidean distances between 2 sets of points.
+
+    Uses the expansion ||a||^2 - 2a.b + ||b||^2 so that all distances come
+    out of a single matrix product. The small negative values this may
+    produce are clipped to zero.
+
+    Args:
+        A (numpy.array): First set of n-dimensional points (a x n).
+        B (numpy.array): Second set of n-dimensional points (b x n).
+        out (numpy.array): Matrix (a x b) the distances are written to. It
+            must have the dtype of both A and B. Defaults to None.
+
+    Returns:
+        numpy.array: Distance between each point of A (rows) and each point
+            of B (columns).
+    """
+    if out is None:
+        dtype = result_type(A, B, 1.0)
+        dist = A.dot(B.T).astype(dtype, copy=False)
+    else:
+        dist = dot(A, B.T, out=out)
+    dist *= -2
+    dist += einsum('ij,ij->i', B, B)
+    dist += einsum('ij,ij->i', A, A)[:, None]
+    maximum(dist, 0, out=dist)
+
+    return dist
+
+
+def euclidean(A, B, out=None):
+    """Calculates Euclidean distances between 2 sets of points.
+
+    Args:
+        A (numpy.array): First set of n-dimensional points (a x n).
+        B (numpy.array): Second set of n-dimensional points (b x n).
+        out (numpy.array): Matrix (a x b) the distances are written to. It
+            must have the dtype of both A and B. Defaults to None.
+
+    Returns:
+        numpy.array: Distance between each point of A (rows) and each point
+            of B (columns).
+    """
+    dist = sq_euclidean(A, B, out=out)
+    sqrt(dist, out=dist)
+    return dist
+
+
+def cosine(A, B, out=None):
+    """Calculates cosine distances (1 - cosine similarity) between 2 sets of
+    points.
+
+    Points with null norm are considered orthogonal to every other point.
+
+    Args:
+        A (numpy.array): First set of n-dimensional points (a x n).
+        B (numpy.array): Second set of n-dimensional points (b x n).
+        out (numpy.array): Matrix (a x b) the distances are written to. It
+            must have the dtype of both A and B. Defaults to None.
+
+    Returns:
+        numpy.array: Distance between each point of A (rows) and each point
+            of B (columns).
+    """
+    if out is None:
+        dtype = result_type(A, B, 1.0)
+        dist = A.dot(B.T).astype(dtype, copy=False)
+    else:
+        dist = dot(A, B.T, out=out)
+    norms = outer(sqrt(einsum('ij,ij->i', A, A)),
+                  sqrt(einsum('ij,ij->i', B, B)))
+    divide(dist, norms, out=dist, where=norms > 0)
+    dist[norms == 0] = 0
+    subtract(1, dist, out=dist)
+    clip(dist, 0, 2, out=dist)
+
+    return dist
+
+
+def manhattan(A, B, out=None):
+    """Calculates Manhattan (L1) distances between 2 sets of points.
+
+    Features are accumulated one at a time, so that no more than a x b
+    differences are held in memory at once.
+
+    Args:
+        A (numpy.array): First set of n-dimensional points (a x n).
+        B (numpy.array): Second set of n-dimensional points (b x n).
+        out (numpy.array): Matrix (a x b) the distances are written to. It
+            must have the dtype of both A and B. Defaults to None.
+
+    Returns:
+        numpy.array: Distance between each point of A (rows) and each point
+            of B (columns).
+    """
+    if out is None:
+        out = zeros((len(A), len(B)), dtype=result_type(A, B, 1.0))
+    else:
+        out[...] = 0
+
+    diff = zeros(out.shape, dtype=out.dtype)
+    for j in range(A.shape[1]):
+        subtract(A[:, j, None], B[None, :, j], out=diff)
+        absolute(diff, out=diff)
+        out += diff
+
+    return out
+
+
+_kernels = {'euclidean': euclidean,
+            'sqeuclidean': sq_euclidean,
+            'cosine': cosine,
+            'manhattan': manhattan}
+
+
+def _get_kernel(metric):
+    """Looks up the routine that computes the given metric."""
+    if metric not in _kernels:
+        raise ValueError("The metric parameter should be 'euclidean', "
+                         "'sqeuclidean', 'cosine' or 'manhattan', '%s' was "
+                         "passed." % metric)
+    return _kernels[metric]
+
+
+def pairwise_dist(A, B, metric='euclidean', tile_size=1024, n_jobs=1):
+    """Calculates the distance between every pair of points of 2 sets.
+
+    The distance matrix is filled in tiles of `tile_size` rows, so that
+    temporaries never exceed `tile_size` x b elements.
+
+    Args:
+        A (numpy.array): First set of n-dimensional points (a x n).
+        B (numpy.array): Second set of n-dimensional points (b x n).
+        metric (str): Distance to compute, one of 'euclidean',
+            'sqeuclidean', 'cosine' or 'manhattan'.
+        tile_size (int): Number of rows of A handled at a time.
+        n_jobs (int): Number of threads tiles are spread over, -1 meaning
+            one per CPU.
+
+    Returns:
+        numpy.array: Distance between each point of A (rows) and each point
+            of B (columns).
+    """
+    kernel = _get_kernel(metric)
+    dtype = result_type(A, B, 1.0)
+    B = B.astype(dtype, copy=False)
+    dist = zeros((len(A), len(B)), dtype=dtype)
+
+    def fill(start):
+        tile = A[start:(start + tile_size)].astype(dtype, copy=False)
+        kernel(tile, B, out=dist[start:(start + tile_size)])
+
+    map_chunks(fill, len(A), tile_size, n_jobs)
+    return dist
+
+
+def closest(A, B, metric='euclidean', tile_size=4096, n_jobs=1, dtype=None,
+            out=None, return_dists=False):
+    """Finds, for every point of A, the closest point of B.
+
+    Distances are computed in tiles of `tile_size` rows of A, so that no
+    more than `tile_size` x b of them are held in memory at once per
+    thread, and a single buffer is shared by all tiles when running on
+    one thread. Points of B made of nan are never picked. For the
+    'euclidean' metric squared distances are compared, which picks the
+    same points without taking square roots.
+
+    Args:
+        A (numpy.array): First set of n-dimensional points (a x n).
+        B (numpy.array): Second set of n-dimensional points (b x n).
+        metric (str): Distance to compute, one of 'euclidean',
+            'sqeuclidean', 'cosine' or 'manhattan'.
+        tile_size (int): Number of rows of A handled at a time.
+        n_jobs (int): Number of threads tiles are spread over, -1 meaning
+            one per CPU.
+        dtype (numpy.dtype): Floating point type distances are computed
+            in. Defaults to None, in which case it follows A and B.
+        out (numpy.array): Column vector the indices are written to.
+            Defaults to None, in which case an int64 one is allocated.
+        return_dists (bool): Whether to also return the distance from each
+            point of A to the closest point of B.
+
+    Returns:
+        numpy.array: Column vector with the indice of the closest point of
+            B to each point of A. If `return_dists` is set a 2-tuple is
+            returned instead, with a column vector of distances after the
+            indices.
+    """
+    kernel = _get_kernel('sqeuclidean' if metric == 'euclidean' else metric)
+    m = len(A)
+    if dtype is None:
+        dtype = result_type(A, B, 1.0)
+    if out is None:
+        out = zeros((m, 1), dtype=int64)
+    dists = zeros((m, 1), dtype=dtype) if return_dists else None
+
+    B = B.astype(dtype, copy=False)
+    shared_buf = None
+    if n_jobs == 1:
+        shared_buf = zeros((min(tile_size, m), len(B)), dtype=dtype)
+
+    def assign(start):
+        tile = A[start:(start + tile_size)].astype(dtype, copy=False)
+        buf = None if shared_buf is None else shared_buf[:len(tile)]
+        dist = kernel(tile, B, out=buf)
+        dist[isnan(dist)] = inf
+        nearest = argmin(dist, axis=1)[:, None]
+        out[start:(start + tile_size)] = nearest
+        if return_dists:
+            dists[start:(start + tile_size)] = take_along_axis(dist, nearest,
+                                                               axis=1)
+
+    map_chunks(assign, m, tile_size, n_jobs)
+
+    if return_dists:
+        if metric == 'euclidean':
+            sqrt(dists, out=dists)
+        return out, dists
+    return out
+
+
+def paired_dist(A, B, metric='euclidean'):
+    """Calculates the distance between each point of A and its counterpart
+    (same row) in B.
+
+    Args:
+        A (numpy.array): First set of n-dimensional points (m x n).
+        B (numpy.array): Second set of n-dimensional points (m x n).
+        metric (str): Distance to compute, one of 'euclidean',
+            'sqeuclidean', 'cosine' or 'manhattan'.
+
+    Returns:
+        numpy.array: Distance between each pair of points.
+    """
+    _get_kernel(metric)
+    if metric == 'cosine':
+        sim = einsum('ij,ij->i', A, B)
+        norms = sqrt(einsum('ij,ij->i', A, A) * einsum('ij,ij->i', B, B))
+        sim = divide(sim, norms, out=zeros(len(sim)), where=norms > 0)
+        return clip(1 - sim, 0, 2)
+
+    diff = subtract(A, B, dtype=result_type(A, B, 1.0))
+    if metric == 'manhattan':
+        return add(absolute(diff), axis=1)
+
+    dist = einsum('ij,ij->i', diff, diff)
+    if metric == 'euclidean':
+        sqrt(dist, out=dist)
+    return dist
@@ -5,10 +5,23 @@
 .. moduleauthor:: Benardi Nunes <benardinunes@gmail.com>
 """
 
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from math import inf, sqrt
+from multiprocessing import cpu_count
 
-from numpy import zeros, int64, power, sum, mean, full, nan
-from numpy.random import permutation
+from numpy import (zeros, int64, power, full, nan, isnan, result_type, argmin,
+                   maximum, sqrt as root, partition, where, fill_diagonal,
+                   argmax, bincount, ndarray, ascontiguousarray, cumsum,
+                   searchsorted, ones, minimum, append, count_nonzero,
+                   argpartition, argsort, int32, float64, zeros_like,
+                   array_equal, subtract, concatenate)
+from numpy import sum as add
+from numpy import random
+from numpy.random import RandomState, SeedSequence
+
+from touvlo.unsupv.dist import sq_euclidean, closest, paired_dist
+from touvlo.utils import group_sums, iter_batches
 
 
 def euclidean_dist(p, q):
@@ -23,167 +36,774 @@ def euclidean_dist(p, q):
     """
     dist = p - q
     dist = power(dist, 2)
-    dist = sum(dist)
+    dist = add(dist)
     dist = sqrt(dist)
 
     return dist
 
 
-def find_closest_centroids(X, initial_centroids):
+def _sq_dists(X, centroids):
+    """Squared Euclidean distances between every example and centroid.
+
+    nan centroids end up infinitely far from every example.
+    """
+    dist = sq_euclidean(X, centroids)
+    dist[isnan(dist)] = inf
+    return dist
+
+
+def _label_dtype(X):
+    """Integer type for the centroids' indices, int32 for 32 bit data."""
+    return int32 if X.dtype.itemsize <= 4 else int64
+
+
+def find_closest_centroids(X, initial_centroids, chunk_size=4096,
+                           dtype=None, out=None, return_dists=False,
+                           metric='euclidean', n_jobs=1):
     """Assigns to each example the indice of the closest centroid.
 
+    For the Euclidean metric squared distances are obtained through the
+    expansion ||x||^2 - 2x.c + ||c||^2, which lets a whole block of
+    examples be compared against every centroid with a single matrix
+    product. Rows are processed in blocks of `chunk_size` so that no more
+    than `chunk_size` x K distances are held in memory at once, all blocks
+    sharing the same buffer. Centroids made of nan (empty clusters) are
+    never assigned.
+
     Args:
         X (numpy.array): Features' dataset
         initial_centroids (numpy.array): List of initialized centroids.
+        chunk_size (int): Number of examples compared against the
+            centroids at a time.
+        dtype (numpy.dtype): Floating point type distances are computed
+            in. Defaults to None, in which case it follows X and
+            initial_centroids.
+        out (numpy.array): Column vector the indices are written to,
+            which allows reusing it across calls. Defaults to None, in
+            which case an int64 one is allocated.
+        return_dists (bool): Whether to also return the squared distance
+            from each example to its closest centroid, which comes for
+            free with the assignment and can be handed to
+            `cost_function`.
+        metric (str): Distance examples are assigned by, one of
+            'euclidean', 'cosine' or 'manhattan' (see `touvlo.unsupv.dist`).
+        n_jobs (int): Number of threads blocks are spread over, -1 meaning
+            one per CPU.
 
     Returns:
-        numpy.array: Column vector of assigned centroids' indices.
+        numpy.array: Column vector of assigned centroids' indices. If
+            `return_dists` is set a 2-tuple is returned instead, with a
+            column vector of squared distances after the indices.
     """
-    m = len(X)
-    K = len(initial_centroids)
-    idx = zeros((m, 1), dtype=int64)
+    if metric == 'euclidean':
+        metric = 'sqeuclidean'
+    result = closest(X, initial_centroids, metric=metric,
+                     tile_size=chunk_size, n_jobs=n_jobs, dtype=dtype,
+                     out=out, return_dists=return_dists)
+
+    if return_dists and metric != 'sqeuclidean':
+        idx, dists = result
+        dists *= dists
+    return result
 
-    for i in range(m):
-        best_c = -1
-        min_dist = inf
-        for k in range(K):
-            dist = euclidean_dist(X[i, :], initial_centroids[k])
-            if dist < min_dist:
-                best_c = k
-                min_dist = dist
 
-        idx[i, :] = best_c
+def _cluster_sums(X, idx, K):
+    """Sums and counts the members of each cluster."""
+    return group_sums(idx, X, K), bincount(idx, minlength=K)
 
-    return idx
+
+def _paired_sq_dists(X, centroids, idx, chunk_size=4096):
+    """Squared distance from every example to its assigned centroid."""
+    dist = zeros(len(X))
+    for start in range(0, len(X), chunk_size):
+        stop = start + chunk_size
+        dist[start:stop] = paired_dist(X[start:stop],
+                                       centroids[idx[start:stop]],
+                                       metric='sqeuclidean')
+
+    return dist
 
 
-def compute_centroids(X, idx, K):
+def compute_centroids(X, idx, K, empty='nan', dtype=None,
+                      return_counts=False):
     """Computes centroids from the mean of its cluster's members.
 
     Computes centroids from the mean of its cluster's members if there are
-    any members for the centroid, else it returns an array of nan.
+    any members for the centroid, else it returns an array of nan or
+    reseeds the centroid, depending on `empty`. Members of every cluster
+    are summed a chunk of rows at a time, without a pass per feature.
 
     Args:
         X (numpy.array): Features' dataset
         idx (numpy.array): Column vector of assigned centroids' indices.
         K (int): Number of centroids.
+        empty (str): What should be done about clusters without members:
+
+         * 'nan': Their centroid is an array of nan.
+         * 'farthest': Their centroid is moved to the example farthest
+           from its own centroid, each empty cluster getting a different
+           example.
+        dtype (numpy.dtype): Floating point type of the centroids. Sums
+            are always accumulated in float64. Defaults to None, in which
+            case it follows X.
+        return_counts (bool): Whether to also return the number of
+            members of each cluster.
 
     Returns:
-        numpy.array: Column vector of newly computed centroids
+        numpy.array: Column vector of newly computed centroids. If
+            `return_counts` is set a 2-tuple is returned instead, with the
+            number of members of each cluster after the centroids.
     """
+    if empty not in ('nan', 'farthest'):
+        raise ValueError("The empty parameter for compute_centroids should "
+                         "be 'nan' or 'farthest', '%s' was passed." % empty)
+
+    idx = idx.ravel()
+    sums, counts = _cluster_sums(X, idx, K)
+    is_empty = counts == 0
+
+    if dtype is None:
+        dtype = result_type(X, 1.0)
+    centroids = full(sums.shape, nan, dtype=dtype)
+    centroids[~is_empty] = sums[~is_empty] / counts[~is_empty, None]
+
+    if empty == 'farthest' and is_empty.any():
+        dist = _paired_sq_dists(X, centroids, idx)
+        n_empty = min(count_nonzero(is_empty), len(X))
+        farthest = argpartition(-dist, n_empty - 1)[:n_empty]
+        farthest = farthest[argsort(-dist[farthest])]
+        centroids[where(is_empty)[0][:n_empty]] = X[farthest]
+
+    if return_counts:
+        return centroids, counts
+    return centroids
 
-    m, n = X.shape
-    elements = None
-    centroids = zeros((K, n))
-    for k in range(K):
-        elements = X[(idx == k).flatten()]
-        if elements.size != 0:
-            centroids[k] = mean(elements, axis=0)
-        else:
-            centroids[k] = full((1, n), nan)
 
-    return centroids
+def _closest_sq_dists(X, centroids, chunk_size=4096):
+    """Squared distance from every example to its closest centroid."""
+    m = len(X)
+    dist = zeros(m)
+    for start in range(0, m, chunk_size):
+        dist[start:(start + chunk_size)] = _sq_dists(
+            X[start:(start + chunk_size)], centroids).min(axis=1)
 
+    return dist
 
-def init_centroids(X, K):
-    """Computes centroids from the mean of its cluster's members.
+
+def _weighted_draw(rand, weights):
+    """Draws an index with probability proportional to its weight."""
+    total = cumsum(weights)
+    if total[-1] <= 0:
+        return rand.randint(len(weights))
+    return min(searchsorted(total, rand.random_sample() * total[-1],
+                            side='right'), len(weights) - 1)
+
+
+def _kmeans_pp(X, K, rand, weights=None):
+    """Picks K examples through k-means++ seeding.
+
+    Each new centroid is drawn with probability proportional to the
+    (optionally weighted) squared distance from the example to the
+    closest centroid picked so far.
+    """
+    m = len(X)
+    if weights is None:
+        weights = ones(m)
+
+    chosen = [_weighted_draw(rand, weights)]
+    dist = _closest_sq_dists(X, X[chosen])
+    for _ in range(1, K):
+        chosen.append(_weighted_draw(rand, weights * dist))
+        minimum(dist, _closest_sq_dists(X, X[chosen[-1:]]), out=dist)
+
+    return X[chosen]
+
+
+def _kmeans_parallel(X, K, rand, n_rounds=5, oversampling=2):
+    """Picks K centroids through k-means|| seeding.
+
+    Starting from a random example, every round keeps each example
+    independently with probability oversampling * K * d^2 / cost, where d
+    is its distance to the closest candidate so far. After a few rounds
+    the O(K) candidates, weighted by how many examples are closest to
+    them, are reduced to K centroids through k-means++.
+    """
+    m = len(X)
+    chosen = [rand.randint(m)]
+    dist = _closest_sq_dists(X, X[chosen])
+    for _ in range(n_rounds):
+        cost = add(dist)
+        if cost <= 0:
+            break
+        prob = oversampling * K * dist / cost
+        picked = where(rand.random_sample(m) < prob)[0]
+        if picked.size == 0:
+            continue
+        chosen.extend(picked)
+        minimum(dist, _closest_sq_dists(X, X[picked]), out=dist)
+
+    candidates = X[chosen]
+    if len(candidates) <= K:
+        extra = rand.choice(m, K - len(candidates), replace=False)
+        return append(candidates, X[extra], axis=0)
+
+    idx = find_closest_centroids(X, candidates)[:, 0]
+    weights = bincount(idx, minlength=len(candidates))
+    return _kmeans_pp(candidates, K, rand, weights=weights)
+
+
+def init_centroids(X, K, _seed=None, method='random'):
+    """Picks initial centroids from the dataset.
 
     Args:
         X (numpy.array): Features' dataset
-        idx (numpy.array): Column vector of assigned centroids' indices.
         K (int): Number of centroids.
+        _seed (int): Seed to make function reproducible despite randomness.
+            Defaults to None, in which case numpy's global random state is
+            used.
+        method (str): Which seeding strategy should be employed:
+
+         * 'random': Picks K distinct examples uniformly at random.
+         * 'kmeans++': Picks examples one at a time with probability
+           proportional to their squared distance to the closest
+           centroid picked so far.
+         * 'kmeans||': Oversamples candidates over a few passes on the
+           data, then reduces them to K centroids through k-means++.
+           Needs far fewer passes than 'kmeans++' for large K.
 
     Returns:
-        numpy.array: Column vector of centroids randomly picked from dataset
+        numpy.array: Column vector of centroids picked from dataset
     """
-    centroids = permutation(X)
-    centroids = centroids[0:K, :]
-    return centroids
+    rand = random if _seed is None else RandomState(_seed)
+
+    if method == 'random':
+        return X[rand.choice(len(X), K, replace=False)]
+    elif method == 'kmeans++':
+        return _kmeans_pp(X, K, rand)
+    elif method == 'kmeans||':
+        return _kmeans_parallel(X, K, rand)
+
+    raise ValueError("The method parameter for init_centroids should be "
+                     "'random', 'kmeans++' or 'kmeans||', '%s' was passed."
+                     % method)
+
+
+def _bounded_assign(X, centroids, chunk_size=4096):
+    """Assigns examples to centroids along with Hamerly's bounds.
+
+    Returns the assigned indices, the exact distance to the assigned
+    centroid (upper bound) and the exact distance to the second closest
+    centroid (lower bound).
+    """
+    m = len(X)
+    K = len(centroids)
+    idx = zeros(m, dtype=_label_dtype(X))
+    upper = zeros(m, dtype=result_type(X, 1.0))
+    lower = full(m, inf, dtype=upper.dtype)
 
+    for start in range(0, m, chunk_size):
+        rows = slice(start, start + chunk_size)
+        dist = _sq_dists(X[rows], centroids)
+        idx[rows] = argmin(dist, axis=1)
+        if K > 1:
+            dist = partition(dist, 1, axis=1)
+            lower[rows] = root(dist[:, 1])
+        upper[rows] = root(dist[:, 0])
 
-def run_kmeans(X, K, max_iters):
+    return idx, upper, lower
+
+
+def _centroid_shift(centroids, new_centroids):
+    """Distance each centroid moved, counting nan centroids as still."""
+    shift = root(add(power(new_centroids - centroids, 2), axis=1))
+    shift[isnan(shift)] = 0
+    return shift
+
+
+def _moved_cost(cost, counts, centroids, new_centroids):
+    """Cost after moving centroids to the mean of their members.
+
+    As each new centroid is the mean of its members, the summed squared
+    distance to it is the one to the old centroid minus the members
+    count times the squared distance between both centroids.
+    """
+    shift = _centroid_shift(centroids, new_centroids)
+    return cost - add(counts * power(shift, 2, dtype=float64))
+
+
+def _run_lloyd(X, centroids, K, max_iters, tol, empty, inertia):
+    """Runs Lloyd's iterations until convergence or max_iters.
+
+    Two index vectors are allocated up front and take turns holding the
+    current and the previous assignment. The cost after every iteration
+    is derived from the distances computed during the assignment.
+    """
+    m = len(X)
+    idx = zeros((m, 1), dtype=_label_dtype(X))
+    prev_idx = zeros_like(idx)
+    _, dists = find_closest_centroids(X, centroids, out=idx,
+                                      return_dists=True)
+    new_centroids, counts = compute_centroids(X, idx, K, empty=empty,
+                                              return_counts=True)
+    n_iter = 1
+    if inertia is not None:
+        inertia.append(_moved_cost(add(dists, dtype=float64), counts,
+                                   centroids, new_centroids) / m)
+
+    for _ in range(max_iters - 1):
+        shift = _centroid_shift(centroids, new_centroids)
+        centroids = new_centroids
+        if shift.max() <= tol:
+            break
+
+        idx, prev_idx = prev_idx, idx
+        _, dists = find_closest_centroids(X, centroids, out=idx,
+                                          return_dists=True)
+        if array_equal(idx, prev_idx):
+            break
+
+        new_centroids, counts = compute_centroids(X, idx, K, empty=empty,
+                                                  return_counts=True)
+        n_iter += 1
+        if inertia is not None:
+            inertia.append(_moved_cost(add(dists, dtype=float64), counts,
+                                       centroids, new_centroids) / m)
+
+    return new_centroids, idx, n_iter
+
+
+def _run_hamerly(X, centroids, K, max_iters, tol, empty, inertia):
+    """Runs Lloyd's iterations skipping distances ruled out by bounds.
+
+    Follows Hamerly's algorithm: each example keeps an upper bound on the
+    distance to its centroid and a lower bound on the distance to every
+    other centroid. Whenever the upper bound does not exceed both the
+    lower bound and half the distance from its centroid to the nearest
+    other centroid the assignment can't change and is left untouched.
+    """
+    idx, upper, lower = _bounded_assign(X, centroids)
+    new_centroids = compute_centroids(X, idx[:, None], K, empty=empty)
+    n_iter = 1
+    if inertia is not None:
+        inertia.append(cost_function(X, idx[:, None], new_centroids))
+
+    for _ in range(max_iters - 1):
+        shift = _centroid_shift(centroids, new_centroids)
+        centroids = new_centroids
+        if shift.max() <= tol:
+            break
+
+        upper += shift[idx]
+        if K > 1:
+            farthest = argmax(shift)
+            runner_up = partition(shift, K - 2)[K - 2]
+            lower -= where(idx == farthest, runner_up, shift[farthest])
+
+        half_gap = _sq_dists(centroids, centroids)
+        fill_diagonal(half_gap, inf)
+        half_gap = root(half_gap.min(axis=1)) / 2
+
+        bound = maximum(half_gap[idx], lower)
+        cand = where(upper > bound)[0]
+        upper[cand] = root(add(power(X[cand] - centroids[idx[cand]], 2),
+                               axis=1))
+        cand = cand[upper[cand] > bound[cand]]
+        prev_idx = idx[cand]
+        idx[cand], upper[cand], lower[cand] = _bounded_assign(X[cand],
+                                                              centroids)
+        if (idx[cand] == prev_idx).all():
+            break
+
+        new_centroids = compute_centroids(X, idx[:, None], K, empty=empty)
+        n_iter += 1
+        if inertia is not None:
+            inertia.append(cost_function(X, idx[:, None], new_centroids))
+
+    return new_centroids, idx[:, None], n_iter
+
+
+def run_kmeans(X, K, max_iters, algorithm='lloyd', initial_centroids=None,
+               tol=0, return_history=False, _seed=None, init='random',
+               empty='nan', dtype=None):
     """Applies kmeans using a single random initialization.
 
+    Iterations stop before `max_iters` as soon as no example changes
+    cluster, which leaves the centroids where further iterations would
+    keep them, or as soon as no centroid moves farther than `tol`.
+
+    Passing `dtype=numpy.float32` halves the memory taken by X (if it
+    isn't float32 already it is copied once), centroids, distances and
+    bounds, and stores indices as int32. Squared distances computed
+    through the expansion ||x||^2 - 2x.c + ||c||^2 then carry an absolute
+    error of about (n + 2) * 6e-8 * (||x||^2 + ||c||^2) for n features,
+    so an example may only be assigned differently than in float64 when
+    its two closest centroids are closer than that to a tie. Costs are
+    accumulated in float64 and stay within a relative error of about
+    n * 6e-8. Centering the data (e.g. with `feature_normalize`) keeps the
+    norms, and hence the error, small.
+
     Args:
         X (numpy.array): Features' dataset
         K (int): Number of centroids.
-        max_iters (int): Number of times the algorithm will be fitted.
+        max_iters (int): Maximum number of times the algorithm will be
+            fitted.
+        algorithm (str): Which variant of the algorithm should be employed:
+
+         * 'lloyd': Recomputes every distance at every iteration.
+         * 'hamerly': Uses triangle inequality bounds to skip distances
+           that can't change an assignment. Yields the same result as
+           'lloyd' while evaluating far fewer distances once most
+           assignments have settled.
+        initial_centroids (numpy.array): Centroids to start from. Defaults
+            to None, in which case they're picked by `init_centroids`.
+        tol (float): Centroid shift (Euclidean distance) at or below which
+            the algorithm is considered to have converged.
+        return_history (bool): Whether to also return the number of
+            iterations run and the cost after each of them. With 'lloyd'
+            the costs are derived from the distances computed during the
+            assignment at no extra cost, while 'hamerly' has to make an
+            extra pass over X per iteration.
+        _seed (int): Seed handed to `init_centroids`.
+        init (str): Seeding strategy handed to `init_centroids`.
+        empty (str): Policy for clusters left without members, handed to
+            `compute_centroids`.
+        dtype (numpy.dtype): Floating point type the algorithm is run in.
+            Defaults to None, in which case it follows X.
 
     Returns:
         (numpy.array, numpy.array): A 2-tuple of centroids, a column vector of
             centroids, and idx, a column vector of assigned centroids' indices.
+            If `return_history` is set a 4-tuple is returned instead, with
+            n_iter, the number of iterations run, and inertia, a list with
+            the cost after each iteration, appended to it.
     """
-    centroids = init_centroids(X, K)
-
-    for _ in range(max_iters):
-        idx = find_closest_centroids(X, centroids)
-        centroids = compute_centroids(X, idx, K)
-
+    if dtype is None:
+        dtype = result_type(X, 1.0)
+    X = X.astype(dtype, copy=False)
+
+    if initial_centroids is None:
+        centroids = init_centroids(X, K, _seed=_seed, method=init)
+    else:
+        centroids = initial_centroids
+    centroids = centroids.astype(dtype, copy=False)
+
+    inertia = [] if return_history else None
+    if algorithm == 'lloyd':
+        centroids, idx, n_iter = _run_lloyd(X, centroids, K, max_iters,
+                                            tol, empty, inertia)
+    elif algorithm == 'hamerly':
+        centroids, idx, n_iter = _run_hamerly(X, centroids, K, max_iters,
+                                              tol, empty, inertia)
+    else:
+        raise ValueError("The algorithm parameter for run_kmeans should be "
+                         "'lloyd' or 'hamerly', '%s' was passed." % algorithm)
+
+    if return_history:
+        return centroids, idx, n_iter, inertia
     return centroids, idx
 
 
-def cost_function(X, idx, centroids):
+def cost_function(X, idx, centroids, chunk_size=4096, dtype=None,
+                  dists=None, metric='euclidean'):
     """Calculates the cost function for K means.
 
     Args:
         X (numpy.array): Features' dataset
         idx (numpy.array): Column vector of assigned centroids' indices.
+        centroids (numpy.array): List of centroids.
+        chunk_size (int): Number of examples evaluated at a time.
+        dtype (numpy.dtype): Floating point type differences are computed
+            in. Squares are always accumulated in float64. Defaults to
+            None, in which case it follows X and centroids.
+        dists (numpy.array): Column vector of squared distances from each
+            example to its centroid, as returned by `find_closest_centroids`.
+            When given the cost is obtained from it instead of from X.
+        metric (str): Distance whose square is averaged, one of
+            'euclidean', 'cosine' or 'manhattan' (see `touvlo.unsupv.dist`).
 
     Returns:
         float: Computed cost
     """
+    if dists is not None:
+        return add(dists, dtype=float64) / len(dists)
+
+    if dtype is None:
+        dtype = result_type(X, centroids, 1.0)
+
     cost = 0
     m = len(X)
-    for i in range(m):
-        centroid = centroids[idx[i][0]]
-        cost += power(euclidean_dist(X[i], centroid), 2)
+    for start in range(0, m, chunk_size):
+        chunk = X[start:(start + chunk_size)]
+        members = centroids[idx[start:(start + chunk_size), 0]]
+        if metric == 'euclidean':
+            diff = subtract(chunk, members, dtype=dtype)
+            diff *= diff
+            cost += add(diff, dtype=float64)
+        else:
+            dist = paired_dist(chunk.astype(dtype, copy=False),
+                               members.astype(dtype, copy=False), metric)
+            cost += add(power(dist, 2), dtype=float64)
 
     cost = cost / m
     return cost
 
 
-def run_intensive_kmeans(X, K, max_iters, n_inits):
+_shared_X = None
+
+
+def _attach_shared(name, shape, dtype):
+    """Worker initializer mapping the dataset held in shared memory."""
+    from multiprocessing.shared_memory import SharedMemory
+
+    global _shared_X
+    shm = SharedMemory(name=name)
+    _shared_X = (shm, ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _restart(K, max_iters, _seed, kwargs, cost_only=False, X=None):
+    """Runs a single kmeans restart, returning its centroids, idx and cost,
+    or only its cost if `cost_only` is set.
+    """
+    if X is None:
+        X = _shared_X[1]
+    if kwargs.get('algorithm', 'lloyd') == 'lloyd':
+        centroids, idx, _, inertia = run_kmeans(X, K, max_iters,
+                                                return_history=True,
+                                                _seed=_seed, **kwargs)
+        cost = inertia[-1]
+    else:
+        centroids, idx = run_kmeans(X, K, max_iters, _seed=_seed, **kwargs)
+        cost = cost_function(X, idx, centroids)
+
+    if cost_only:
+        return cost
+    return centroids, idx, cost
+
+
+def _task_seeds(_seed, n_tasks):
+    """Derives independent per task seeds from a single seed.
+
+    The seeds depend only on `_seed` and the task's position, never on
+    which worker ends up running the task.
+    """
+    if _seed is None:
+        _seed = random.randint(2 ** 32)
+    children = SeedSequence(_seed).spawn(n_tasks)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def _run_restarts(X, tasks, n_jobs):
+    """Runs kmeans restarts, fanning them out over processes if asked to.
+
+    Each task is a tuple of `_restart` arguments. Pairs of the task's
+    position and its result are yielded as tasks finish, so that callers
+    can reduce them without holding every restart's idx at once. With
+    more than one job
+    X is copied once into shared memory from which every worker reads,
+    rather than being pickled along with each task. Shared memory and
+    worker initializers need Python 3.8, so older versions fall back to
+    pickling X with each task.
+    """
+    if n_jobs == -1:
+        n_jobs = cpu_count()
+    if n_jobs == 1:
+        for i, task in enumerate(tasks):
+            yield i, _restart(*task, X=X)
+        return
+
+    if sys.version_info < (3, 8):
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {executor.submit(_restart, *task, X=X): i
+                       for i, task in enumerate(tasks)}
+            yield from _as_completed(futures)
+        return
+
+    from multiprocessing.shared_memory import SharedMemory
+
+    X = ascontiguousarray(X)
+    shm = SharedMemory(create=True, size=max(X.nbytes, 1))
+    try:
+        ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[...] = X
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_attach_shared,
+                                 initargs=(shm.name, X.shape,
+                                           X.dtype)) as executor:
+            futures = {executor.submit(_restart, *task): i
+                       for i, task in enumerate(tasks)}
+            yield from _as_completed(futures)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _as_completed(futures):
+    """Yields the position and result of each future as it finishes,
+    dropping it right after."""
+    for future in as_completed(futures):
+        yield futures.pop(future), future.result()
+
+
+def _pick_best(results):
+    """Picks the centroids, idx and cost of the cheapest restart.
+
+    Only the best restart so far is kept, and ties go to the earliest
+    task, so that the pick does not depend on the order tasks finish in.
+    """
+    min_cost, best_pos = inf, None
+    best_idx = None
+    best_centroids = None
+    for pos, (centroids, idx, cost) in results:
+        if cost < min_cost or (cost == min_cost and best_pos is not None
+                               and pos < best_pos):
+            min_cost, best_pos = cost, pos
+            best_idx = idx
+            best_centroids = centroids
+
+    return best_centroids, best_idx, min_cost
+
+
+def run_intensive_kmeans(X, K, max_iters, n_inits, n_jobs=1, _seed=None,
+                         **kwargs):
     """Applies kmeans using multiple random initializations.
 
     Args:
         X (numpy.array): Features' dataset
         K (int): Number of centroids.
-        max_iters (int): Number of times the algorithm will be fitted.
+        max_iters (int): Maximum number of times the algorithm will be
+            fitted.
         n_inits (int): Number of random initialization.
+        n_jobs (int): Number of processes the initializations are spread
+            over, -1 meaning one per CPU.
+        _seed (int): Seed to make function reproducible despite randomness.
+            Results depend on it but not on `n_jobs`.
+        **kwargs: Keyword arguments handed to `run_kmeans`, such as
+            algorithm, tol, init or empty.
 
     Returns:
         (numpy.array, numpy.array): A 2-tuple of centroids, a column vector of
             centroids, and idx, a column vector of assigned centroids' indices.
     """
-    min_cost = inf
-    best_idx = None
-    best_centroids = None
-    for _ in range(n_inits):
-        centroids, idx = run_kmeans(X, K, max_iters)
-        cost = cost_function(X, idx, centroids)
-        if cost < min_cost:
-            best_idx = idx
-            best_centroids = centroids
-
-    return best_centroids, best_idx
+    tasks = [(K, max_iters, task_seed, kwargs)
+             for task_seed in _task_seeds(_seed, n_inits)]
+    centroids, idx, _ = _pick_best(_run_restarts(X, tasks, n_jobs))
+    return centroids, idx
 
 
-def elbow_method(X, K_values, max_iters, n_inits):
+def elbow_method(X, K_values, max_iters, n_inits, n_jobs=1, _seed=None,
+                 **kwargs):
     """Calculates the cost for each given K.
 
     Args:
         X (numpy.array): Features' dataset
         K_values (list(int)): List of possible number of centroids.
-        max_iters (int): Number of times the algorithm will be fitted.
+        max_iters (int): Maximum number of times the algorithm will be
+            fitted.
         n_inits (int): Number of random initialization.
+        n_jobs (int): Number of processes the initializations of every K
+            are spread over, -1 meaning one per CPU.
+        _seed (int): Seed to make function reproducible despite randomness.
+            Results depend on it but not on `n_jobs`.
+        **kwargs: Keyword arguments handed to `run_kmeans`, such as
+            algorithm, tol, init or empty.
 
     Returns:
         (list(float)): a list of cost values for each K.
     """
-    cost_values = []
-    for K in K_values:
-        centroids, idx = run_intensive_kmeans(X, K, max_iters, n_inits)
-        cost = cost_function(X, idx, centroids)
-        cost_values.append(cost)
+    seeds = _task_seeds(_seed, len(K_values) * n_inits)
+    tasks = [(K, max_iters, seeds[i * n_inits + j], kwargs, True)
+             for i, K in enumerate(K_values) for j in range(n_inits)]
+
+    cost_values = [inf] * len(K_values)
+    for pos, cost in _run_restarts(X, tasks, n_jobs):
+        if cost < cost_values[pos // n_inits]:
+            cost_values[pos // n_inits] = cost
 
     return cost_values
+
+
+def partial_fit_kmeans(X, centroids, counts):
+    """Updates centroids with a single mini-batch of examples.
+
+    Applies Sculley's mini-batch update, in which every centroid moves
+    towards each of its newly assigned examples with a per-centroid
+    learning rate of 1 / (number of examples it has seen so far). As
+    this is the running mean of the examples assigned to the centroid,
+    the whole batch is folded in at once.
+
+    Args:
+        X (numpy.array): Mini-batch of the features' dataset.
+        centroids (numpy.array): Current centroids.
+        counts (numpy.array): Number of examples each centroid has seen.
+
+    Returns:
+        (numpy.array, numpy.array): A 2-tuple of centroids, the updated
+            centroids, and counts, the updated number of examples each
+            centroid has seen.
+    """
+    K = len(centroids)
+    idx = find_closest_centroids(X, centroids)[:, 0]
+
+    batch_sums, batch_counts = _cluster_sums(X, idx, K)
+
+    counts = counts + batch_counts
+    seen = batch_counts > 0
+    centroids = centroids.astype(float, copy=True)
+    step = batch_sums[seen] - batch_counts[seen, None] * centroids[seen]
+    centroids[seen] += step / counts[seen, None]
+
+    return centroids, counts
+
+
+def run_minibatch_kmeans(X, K, batch_size=1024, n_epochs=1,
+                         initial_centroids=None, init='random', _seed=None):
+    """Applies mini-batch kmeans over data that needn't fit in memory.
+
+    Args:
+        X (numpy.array or iterable): Features' dataset, either as an array
+            (a numpy.memmap will do) read in blocks of `batch_size` rows,
+            or as an iterable of row blocks, which is consumed once.
+        K (int): Number of centroids.
+        batch_size (int): Number of examples in mini batch when X is an
+            array.
+        n_epochs (int): Number of passes over X when X is an array.
+        initial_centroids (numpy.array): Centroids to start from. Defaults
+            to None, in which case they're picked by `init_centroids`
+            from the first mini-batches, as many as it takes to gather K
+            examples.
+        init (str): Seeding strategy handed to `init_centroids`.
+        _seed (int): Seed handed to `init_centroids`.
+
+    Raises:
+        ValueError: If no initial centroids are given and X has fewer than
+            K examples.
+
+    Returns:
+        (numpy.array, numpy.array): A 2-tuple of centroids, a column vector of
+            centroids, and counts, the number of examples each centroid has
+            seen. Examples can then be assigned with `find_closest_centroids`
+            and scored with `cost_function` chunk by chunk.
+    """
+    if not hasattr(X, 'shape'):
+        n_epochs = 1
+
+    centroids = initial_centroids
+    counts = zeros(K, dtype=int64)
+    pending = []
+    for _ in range(n_epochs):
+        for batch in iter_batches(X, batch_size):
+            if centroids is None:
+                # small batches are held until there's enough to seed from
+                pending.append(batch)
+                if sum(len(held) for held in pending) < K:
+                    continue
+                batch = concatenate(pending)
+                pending = []
+                centroids = init_centroids(batch, K, _seed=_seed,
+                                           method=init)
+            centroids, counts = partial_fit_kmeans(batch, centroids, counts)
+
+    if centroids is None:
+        raise ValueError("run_minibatch_kmeans needs at least K=%d examples "
+                         "to pick initial centroids from, %d were given."
+                         % (K, sum(len(held) for held in pending)))
+    return centroids, counts
@@ -5,23 +5,166 @@
 .. moduleauthor:: Benardi Nunes <benardinunes@gmail.com>
 """
 
-from numpy.linalg import svd
-from numpy import diag
+from numpy import (diag, random, vstack, einsum, ascontiguousarray, empty,
+                   result_type, hstack, concatenate, cumsum,
+                   searchsorted)
+from numpy.linalg import svd, qr
+from numpy.random import RandomState
 
+from touvlo.utils import iter_batches
 
-def pca(X):
+
+def _randomized_svd(X, k, n_oversamples, n_iter, _seed):
+    """Approximates the top k singular triplets of X through a randomized
+    range finder (Halko, Martinsson and Tropp).
+
+    X is sampled with a Gaussian test matrix of k + `n_oversamples`
+    columns, the sample's range is refined by `n_iter` power iterations,
+    re-orthonormalized at every step, and X is projected onto it, so that
+    only a small (k + n_oversamples) x n matrix is ever decomposed.
+    """
+    rand = random if _seed is None else RandomState(_seed)
+    m, n = X.shape
+    omega = rand.normal(size=(n, min(k + n_oversamples, m, n)))
+
+    Q, _ = qr(X.dot(omega))
+    for _ in range(n_iter):
+        Q, _ = qr(X.T.dot(Q))
+        Q, _ = qr(X.dot(Q))
+
+    _, s, Vt = svd(Q.T.dot(X), full_matrices=False)
+    return Vt[:k].T, s[:k]
+
+
+def _subspace_eig(X, retained, block_size, tol, max_iter, _seed):
+    """Finds principal components a block at a time until they retain the
+    given share of the variance.
+
+    Each block is found by subspace iteration on X^T X, applied as two
+    products with X, with the components already found deflated and a
+    Rayleigh-Ritz step rotating it onto eigenvectors, until the block's
+    captured variance settles within `tol`. Like a Lanczos solver
+    stopped early, only as many components as the target requires are
+    ever computed.
+    """
+    rand = random if _seed is None else RandomState(_seed)
+    m, n = X.shape
+    total = einsum('ij,ij->', X, X)
+    V = empty((n, 0), dtype=result_type(X, 1.0))
+    sq_sv = empty(0)
+
+    while V.shape[1] < n and sq_sv.sum() < retained * total:
+        b = min(block_size, n - V.shape[1])
+        # extra guard vectors speed up convergence of the block's last ones
+        Q, _ = qr(rand.normal(size=(n, min(2 * b, n - V.shape[1]))))
+        captured = 0
+        for _ in range(max_iter):
+            Y = X.T.dot(X.dot(Q))
+            Y -= V.dot(V.T.dot(Y))
+            Q, _ = qr(Y)
+            _, s, Wt = svd(X.dot(Q), full_matrices=False)
+            Q = Q.dot(Wt.T)
+            previous, captured = captured, (s[:b] ** 2).sum()
+            if captured - previous <= tol * captured:
+                break
+
+        V = hstack((V, Q[:, :b]))
+        sq_sv = concatenate((sq_sv, s[:b] ** 2))
+
+    order = sq_sv.argsort()[::-1]
+    return V[:, order], sq_sv[order], total
+
+
+def select_components(S, retained=0.99, total=None):
+    """Picks the least number of components that retain a share of the
+    variance.
+
+    Args:
+        S (numpy.array): Eigenvalues of covariance matrix in decreasing
+            order, either as a flat vector or on the diagonal of a matrix.
+        retained (float): Share of the variance to retain, between 0 and 1.
+        total (float): Total variance of the data. Defaults to None, in
+            which case it is the sum of S, which must then hold every
+            eigenvalue.
+
+    Returns:
+        int: Number of components k that retain at least the given share
+            of the variance, or all of them if they never do.
+    """
+    if S.ndim == 2:
+        S = diag(S)
+    if total is None:
+        total = S.sum()
+    k = searchsorted(cumsum(S), retained * total * (1 - 1e-12)) + 1
+    return min(k, len(S))
+
+
+def pca(X, k=None, method='full', n_oversamples=10, n_iter=4, _seed=None,
+        retained=None, block_size=10, tol=1e-10, max_iter=200):
     """Runs Principal Component Analysis on dataset
 
     Args:
         X (numpy.array): Features' dataset
+        k (int): Number of components to compute. Defaults to None, in
+            which case all of them are.
+        method (str): How components should be computed:
+
+         * 'full': Decomposes the whole covariance matrix.
+         * 'randomized': Approximates the top k components with a
+           randomized SVD of X, never forming the n x n covariance matrix.
+           Requires k.
+         * 'subspace': Computes components a block at a time, through
+           subspace iteration on X, and stops as soon as they retain the
+           `retained` share of the variance. Requires retained.
+        n_oversamples (int): Number of extra directions sampled by the
+            'randomized' method, which improve its accuracy.
+        n_iter (int): Number of power iterations of the 'randomized'
+            method, which help when the spectrum decays slowly.
+        _seed (int): Seed to make the 'randomized' and 'subspace' methods
+            reproducible.
+        retained (float): Share of the variance, between 0 and 1, the
+            components returned should retain, as in `select_components`.
+            Defaults to None. Ignored if k is given.
+        block_size (int): Number of components the 'subspace' method
+            computes at a time.
+        tol (float): Relative change in captured variance under which the
+            'subspace' method considers a block converged.
+        max_iter (int): Most iterations the 'subspace' method spends on
+            each block.
 
     Returns:
         (numpy.array, numpy.array): A 2-tuple of U, eigenvectors of covariance
             matrix, and S, eigenvalues (on diagonal) of covariance matrix.
+            When k or retained is given U holds only the top k eigenvectors
+            (n x k) and S is a flat vector of their k eigenvalues.
     """
     m, n = X.shape
+    if method == 'randomized':
+        if k is None:
+            raise ValueError("The randomized method of pca requires the "
+                             "number of components k.")
+        U, s = _randomized_svd(X, k, n_oversamples, n_iter, _seed)
+        return U, (s ** 2) / m
+    elif method == 'subspace':
+        if retained is None:
+            raise ValueError("The subspace method of pca requires the share "
+                             "of variance retained.")
+        U, sq_sv, total = _subspace_eig(X, retained, block_size, tol,
+                                        max_iter, _seed)
+        if k is None:
+            k = select_components(sq_sv, retained, total=total)
+        return U[:, :k], sq_sv[:k] / m
+    elif method != 'full':
+        raise ValueError("The method parameter for pca should be 'full', "
+                         "'randomized' or 'subspace', '%s' was passed."
+                         % method)
+
     Sigma = (1 / m) * X.T.dot(X)
     U, S, V = svd(Sigma)
+    if k is None and retained is not None:
+        k = select_components(S, retained)
+    if k is not None:
+        return U[:, :k], S[:k]
     S = diag(S)
 
     return U, S
@@ -56,3 +199,185 @@ def recover_data(Z, U, k):
     """
     X_rec = Z.dot(U[:, 0:k].T)
     return X_rec
+
+
+class PCA:
+    """Projects data onto, and recovers it from, its top k principal
+    components.
+
+    The reduced eigenvector matrix and its transpose are sliced and made
+    contiguous once, instead of on every call as `project_data` and
+    `recover_data` do, and inputs are handled in blocks of `chunk_size`
+    rows so that temporaries stay bounded on large or memory-mapped ones.
+
+    Args:
+        U (numpy.array): eigenvectors of covariance matrix
+        k (int): Number of features in reduced data representation.
+            Defaults to None, in which case all columns of U are kept.
+        chunk_size (int): Number of rows handled at a time.
+
+    Attributes:
+        U_reduce (numpy.array): Top k eigenvectors of covariance matrix
+            (n x k).
+    """
+
+    def __init__(self, U, k=None, chunk_size=4096):
+        if k is None:
+            k = U.shape[1]
+        self.U_reduce = ascontiguousarray(U[:, :k])
+        self._U_reduce_T = ascontiguousarray(self.U_reduce.T)
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def fit(cls, X, k, chunk_size=4096, **kwargs):
+        """Computes the top k principal components of a dataset.
+
+        Args:
+            X (numpy.array): Normalized features' dataset
+            k (int): Number of features in reduced data representation
+            chunk_size (int): Number of rows handled at a time.
+            **kwargs: Further arguments to `pca`, such as `method`.
+
+        Returns:
+            PCA: Transformer onto the top k components of X.
+        """
+        U, _ = pca(X, k=k, **kwargs)
+        return cls(U, chunk_size=chunk_size)
+
+    def _map_chunks(self, X, M):
+        out = empty((len(X), M.shape[1]), dtype=result_type(X, M))
+        for start in range(0, len(X), self.chunk_size):
+            stop = start + self.chunk_size
+            X[start:stop].dot(M, out=out[start:stop])
+        return out
+
+    def transform(self, X):
+        """Computes reduced data representation (projected data)
+
+        Args:
+            X (numpy.array): Normalized features' dataset
+
+        Returns:
+            numpy.array: Reduced data representation (projection)
+        """
+        return self._map_chunks(X, self.U_reduce)
+
+    def inverse_transform(self, Z):
+        """Recovers an approximation of original data using the projected
+        data
+
+        Args:
+            Z (numpy.array): Reduced data representation (projection)
+
+        Returns:
+            numpy.array: Approximated features' dataset
+        """
+        return self._map_chunks(Z, self._U_reduce_T)
+
+    def reconstruction_error(self, X):
+        """Computes the squared distance between each example and its
+        recovered approximation.
+
+        The residual is recovered a chunk at a time, so that memory stays
+        bounded by `chunk_size` rows, and never for the whole of X.
+
+        Args:
+            X (numpy.array): Normalized features' dataset
+
+        Returns:
+            numpy.array: Squared reconstruction error of each example.
+        """
+        err = empty(len(X), dtype=result_type(X, self.U_reduce))
+        for start in range(0, len(X), self.chunk_size):
+            chunk = X[start:(start + self.chunk_size)]
+            residual = chunk - chunk.dot(self.U_reduce).dot(self._U_reduce_T)
+            err[start:(start + self.chunk_size)] = einsum('ij,ij->i',
+                                                          residual, residual)
+        return err
+
+
+class IncrementalPCA:
+    """Runs Principal Component Analysis on a dataset a batch at a time.
+
+    The top k components are kept as the singular values and right
+    singular vectors of the data seen so far. Each batch is stacked under
+    them and the small result decomposed again, so that memory use depends
+    on the batch size and k rather than on the number of examples, and
+    datasets larger than memory can be read from a memmap or a generator.
+    As with `pca`, X is expected to be normalized already. The components
+    are exact while the data seen has rank at most k, and an approximation
+    of `pca`'s otherwise.
+
+    Args:
+        k (int): Number of components kept.
+
+    Attributes:
+        count (int): Number of examples seen.
+        U (numpy.array): Top k eigenvectors of the covariance matrix (n x k),
+            as expected by `project_data` and `recover_data`.
+        singular_values (numpy.array): Singular values of the data seen
+            along each component.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.U = None
+        self.singular_values = None
+        self._sq_norm = 0
+
+    def partial_fit(self, X):
+        """Updates the components with a batch of examples.
+
+        Args:
+            X (numpy.array): Batch of the normalized features' dataset.
+
+        Returns:
+            IncrementalPCA: The updated estimator itself.
+        """
+        if len(X) == 0:
+            return self
+        self.count += len(X)
+        self._sq_norm += einsum('ij,ij->', X, X)
+        if self.U is not None:
+            X = vstack((self.singular_values[:, None] * self.U.T, X))
+
+        _, s, Vt = svd(X, full_matrices=False)
+        self.U = Vt[:self.k].T
+        self.singular_values = s[:self.k]
+        return self
+
+    def fit(self, X, batch_size=1024):
+        """Computes the components from every batch of a dataset.
+
+        Whatever was seen before is discarded; use `partial_fit` to add
+        data to the current estimate.
+
+        Args:
+            X (numpy.array): Normalized features' dataset, possibly a
+                memmap, or an iterator over blocks of its rows.
+            batch_size (int): Number of rows handled at a time when X is an
+                array.
+
+        Returns:
+            IncrementalPCA: The fitted estimator itself.
+        """
+        self._reset()
+        for batch in iter_batches(X, batch_size):
+            self.partial_fit(batch)
+        return self
+
+    @property
+    def S(self):
+        """numpy.array: Top k eigenvalues of the covariance matrix, the
+        variance explained by each component."""
+        return (self.singular_values ** 2) / self.count
+
+    @property
+    def explained_variance_ratio(self):
+        """numpy.array: Share of the total variance explained by each
+        component."""
+        return (self.singular_values ** 2) / self._sq_norm
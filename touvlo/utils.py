@@ -5,8 +5,12 @@
 .. moduleauthor:: Benardi Nunes <benardinunes@gmail.com>
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
 from numpy import (zeros, copy, std, mean, float64, exp, seterr,
-                   where, array, maximum)
+                   where, array, maximum, argsort, flatnonzero, concatenate,
+                   arange, add)
 
 
 # sigmoid gradient function
@@ -273,3 +277,90 @@ def mean_normlztn(Y, R):
         Y_norm[i, idx] = Y[i, idx] - Y_mean[i]
 
     return Y_norm, Y_mean
+
+
+def iter_batches(X, batch_size):
+    """Yields blocks of rows from an array, or those of an iterable.
+
+    Args:
+        X (numpy.array): Dataset, possibly a memmap, or an iterable over
+            blocks of its rows, which are passed through as they are.
+        batch_size (int): Number of rows in each block of an array.
+
+    Yields:
+        numpy.array: Consecutive blocks of rows of X.
+    """
+    if hasattr(X, 'shape'):
+        for start in range(0, len(X), batch_size):
+            yield X[start:(start + batch_size)]
+    else:
+        for batch in X:
+            yield batch
+
+
+def map_chunks(func, m, chunk_size, n_jobs=1):
+    """Applies func to the start of every chunk of m rows, possibly on
+    threads.
+
+    numpy releases the GIL in its matrix products, ufuncs and solvers, so
+    chunks do run in parallel.
+
+    Args:
+        func (Callable): Function handle that processes the chunk of rows
+            starting at the index it is given.
+        m (int): Number of rows.
+        chunk_size (int): Number of rows in each chunk.
+        n_jobs (int): Number of threads chunks are spread over, -1 meaning
+            one per CPU.
+    """
+    starts = range(0, m, chunk_size)
+    if n_jobs == -1:
+        n_jobs = cpu_count()
+    if n_jobs == 1:
+        for start in starts:
+            func(start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(func, starts))
+
+
+def group_sums(idx, values, num_groups, chunk_size=4096, out=None):
+    """Sums the rows of values that share the same index.
+
+    Rows are handled a chunk at a time, so temporaries never exceed
+    `chunk_size` rows. With few groups each chunk is summed through a
+    product with its one-hot (num_groups x chunk_size) membership matrix;
+    with many, its rows are sorted by index and each run of rows sharing
+    an index is summed with `add.reduceat`. Sums are accumulated in
+    float64.
+
+    Args:
+        idx (numpy.array): Flat array with the group of each row of values.
+        values (numpy.array): Rows to be summed (m x n).
+        num_groups (int): Number of groups, every index being below it.
+        chunk_size (int): Number of rows handled at a time.
+        out (numpy.array): Matrix (num_groups x n) the sums are added to.
+            Defaults to None, in which case they are added to zeros.
+
+    Returns:
+        numpy.array: Sum of the rows of each group (num_groups x n).
+    """
+    if out is None:
+        out = zeros((num_groups, values.shape[1]), dtype=float64)
+
+    for start in range(0, len(idx), chunk_size):
+        chunk_idx = idx[start:(start + chunk_size)]
+        chunk = values[start:(start + chunk_size)]
+        if num_groups <= 64:
+            one_hot = zeros((num_groups, len(chunk_idx)), dtype=float64)
+            one_hot[chunk_idx, arange(len(chunk_idx))] = 1
+            out += one_hot.dot(chunk)
+        else:
+            order = argsort(chunk_idx, kind='stable')
+            sorted_idx = chunk_idx[order]
+            runs = flatnonzero(concatenate(
+                ([True], sorted_idx[1:] != sorted_idx[:-1])))
+            out[sorted_idx[runs]] += add.reduceat(chunk[order], runs,
+                                                  axis=0, dtype=float64)
+
+    return out